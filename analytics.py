@@ -0,0 +1,253 @@
+import re
+from datetime import date, datetime, timedelta
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from money import format_amount
+
+# Статистика за произвольный период. Диапазон дат раскладывается на
+# календарные корзины: целые месяцы и недели берутся из period_totals,
+# крайние дни - из daily_totals. Диапазон в несколько лет читается как
+# несколько десятков строк по месяцам плюс не больше 12 недель и дней по краям.
+#
+# Период выбирается кнопками под статистикой: callback_data «stats:<период>».
+
+STATS_PREFIX = "stats:"
+
+PERIOD_BUTTONS = [
+    [("Неделя", "week"), ("Месяц", "month"), ("Прошлый месяц", "prev_month")],
+    [("30 дней", "30d"), ("Год", "year"), ("Всё время", "all")],
+    [("📅 Свой период", "custom")],
+]
+
+MONTH_NAMES = (
+    "январь", "февраль", "март", "апрель", "май", "июнь",
+    "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь",
+)
+
+_CUSTOM_PERIOD = re.compile(r"(\d{1,2}\.\d{1,2}\.\d{4})(?:\s*[-–—]\s*(\d{1,2}\.\d{1,2}\.\d{4}))?")
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _add_months(day, months):
+    """Сдвигает дату на months месяцев; число ограничивается длиной месяца."""
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    first = date(year, month + 1, 1)
+    last = _add_months_start(first, 1) - timedelta(days=1)
+    return first.replace(day=min(day.day, last.day))
+
+
+def _add_months_start(first, months):
+    index = first.year * 12 + first.month - 1 + months
+    year, month = divmod(index, 12)
+    return date(year, month + 1, 1)
+
+
+def _month_end(day):
+    return _add_months_start(_month_start(day), 1) - timedelta(days=1)
+
+
+def _format_date(day):
+    return day.strftime("%d.%m.%Y")
+
+
+class Period:
+    """Диапазон дат [start, end] с заголовком; start и end равны None - всё время."""
+
+    def __init__(self, key, title, start=None, end=None, previous=None):
+        self.key = key
+        self.title = title
+        self.start = start
+        self.end = end
+        # Предыдущий сопоставимый период для сравнения
+        self.previous = previous
+
+    @property
+    def cache_view(self):
+        # Одни и те же даты у разных периодов отличаются заголовком и периодом сравнения
+        key = f"statistics:{self.key}:{self.start}:{self.end}"
+        if self.previous is not None:
+            key += f":{self.previous.start}:{self.previous.end}"
+        return key
+
+
+def _shifted(start, end, months=0, days=0):
+    # Целые месяцы переходят в целые месяцы, даже если в них разное число дней
+    if months:
+        previous_end = _add_months(end, months)
+        if end == _month_end(end):
+            previous_end = _month_end(previous_end)
+        return _add_months(start, months), previous_end
+    return start + timedelta(days=days), end + timedelta(days=days)
+
+
+def resolve_period(key, today=None):
+    """Период по ключу кнопки; ValueError для неизвестного ключа."""
+    today = today or date.today()
+    if key == "30d":
+        # Как и раньше: последние 30 дней вместе с сегодняшним днём
+        start = today - timedelta(days=30)
+        previous = Period(key, "", *_shifted(start, today, days=-31))
+        return Period(key, "за последние 30 дней", start, today, previous)
+    if key == "week":
+        start = today - timedelta(days=today.weekday())
+        previous = Period(key, "", *_shifted(start, today, days=-7))
+        return Period(key, "за текущую неделю", start, today, previous)
+    if key == "month":
+        start = _month_start(today)
+        previous = Period(key, "", *_shifted(start, today, months=-1))
+        return Period(key, f"за {MONTH_NAMES[today.month - 1]} {today.year}", start, today, previous)
+    if key == "prev_month":
+        start = _add_months_start(_month_start(today), -1)
+        end = _month_end(start)
+        previous = Period(key, "", *_shifted(start, end, months=-1))
+        return Period(key, f"за {MONTH_NAMES[start.month - 1]} {start.year}", start, end, previous)
+    if key == "year":
+        start = date(today.year, 1, 1)
+        previous = Period(key, "", *_shifted(start, today, months=-12))
+        return Period(key, f"за {today.year} год", start, today, previous)
+    if key == "all":
+        return Period(key, "за всё время")
+    raise ValueError(f"Неизвестный период: {key}")
+
+
+def parse_custom_period(text):
+    """Период из текста «01.01.2024-31.03.2024» или одной даты; ValueError, если некорректен."""
+    match = _CUSTOM_PERIOD.fullmatch((text or "").strip())
+    if not match:
+        raise ValueError("некорректный период")
+    start = datetime.strptime(match.group(1), "%d.%m.%Y").date()
+    end = datetime.strptime(match.group(2), "%d.%m.%Y").date() if match.group(2) else start
+    if end < start:
+        start, end = end, start
+    if start.day == 1 and end == _month_end(end):
+        # Целые месяцы сравниваются с таким же числом предыдущих месяцев
+        months = (end.year - start.year) * 12 + end.month - start.month + 1
+        previous = Period("custom", "", *_shifted(start, end, months=-months))
+    else:
+        length = (end - start).days + 1
+        previous = Period("custom", "", *_shifted(start, end, days=-length))
+    if start == end:
+        title = f"за {_format_date(start)}"
+    else:
+        title = f"с {_format_date(start)} по {_format_date(end)}"
+    return Period("custom", title, start, end, previous)
+
+
+def split_range(start, end):
+    """Раскладывает [start, end] на корзины [(grain, первая, последняя)], grain: day, week или month.
+
+    Для недель и месяцев границы - даты начала корзин.
+    """
+    pieces = []
+    first_month = start if start.day == 1 else _add_months_start(_month_start(start), 1)
+    after_months = first_month
+    while _add_months_start(after_months, 1) - timedelta(days=1) <= end:
+        after_months = _add_months_start(after_months, 1)
+    if after_months > first_month:
+        pieces.append(("month", first_month, _add_months_start(after_months, -1)))
+        edges = [(start, first_month - timedelta(days=1)), (after_months, end)]
+    else:
+        edges = [(start, end)]
+
+    for low, high in edges:
+        if low > high:
+            continue
+        first_week = low + timedelta(days=(7 - low.weekday()) % 7)
+        after_weeks = first_week
+        while after_weeks + timedelta(days=6) <= high:
+            after_weeks += timedelta(days=7)
+        if after_weeks > first_week:
+            pieces.append(("week", first_week, after_weeks - timedelta(days=7)))
+            days = [(low, first_week - timedelta(days=1)), (after_weeks, high)]
+        else:
+            days = [(low, high)]
+        for first_day, last_day in days:
+            if first_day <= last_day:
+                pieces.append(("day", first_day, last_day))
+    return pieces
+
+
+async def fetch_totals(conn, user_id, start=None, end=None):
+    """Итоги по категориям за период: [(категория, сумма в копейках, число расходов)]."""
+    if start is None:
+        # Всё время - это все месяцы
+        return await conn.execute_fetchall(
+            "SELECT category, SUM(sum_cents), SUM(count) FROM period_totals "
+            "WHERE user_id = ? AND grain = 'month' GROUP BY category",
+            (user_id,)
+        )
+    parts = []
+    params = []
+    for grain, first, last in split_range(start, end):
+        if grain == "day":
+            parts.append(
+                "SELECT category, sum_cents, count FROM daily_totals "
+                "WHERE user_id = ? AND day BETWEEN ? AND ?"
+            )
+            params.extend((user_id, first.isoformat(), last.isoformat()))
+        else:
+            parts.append(
+                "SELECT category, sum_cents, count FROM period_totals "
+                "WHERE user_id = ? AND grain = ? AND period BETWEEN ? AND ?"
+            )
+            params.extend((user_id, grain, first.isoformat(), last.isoformat()))
+    return await conn.execute_fetchall(
+        f"SELECT category, SUM(sum_cents), SUM(count) FROM ({' UNION ALL '.join(parts)}) GROUP BY category",
+        params
+    )
+
+
+def _change(current, previous):
+    if not previous:
+        return " 🆕" if current else ""
+    percent = (current - previous) * 100 / previous
+    if abs(percent) < 0.05:
+        return " = 0%"
+    return f" {'▲' if percent > 0 else '▼'} {abs(percent):.1f}%"
+
+
+def period_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=f"{STATS_PREFIX}{key}") for text, key in row]
+        for row in PERIOD_BUTTONS
+    ])
+
+
+def build_report(period, totals, previous_totals=None):
+    """Текст статистики за период со сравнением с предыдущим периодом."""
+    totals = sorted(totals, key=lambda row: row[1], reverse=True)
+    total_cents = sum(amount for _, amount, _ in totals)
+    previous = {category: amount for category, amount, _ in previous_totals or ()}
+    previous_cents = sum(previous.values())
+    compare = period.previous is not None and previous_totals is not None
+
+    response = f"📊 Статистика расходов {period.title}:\n"
+    if period.start is not None and period.key != "custom":
+        response += f"📅 {_format_date(period.start)} - {_format_date(period.end)}\n"
+    response += "\n"
+    response += f"💰 Общая сумма: {format_amount(total_cents)} руб."
+    if compare:
+        response += _change(total_cents, previous_cents)
+    response += "\n"
+    if compare:
+        response += (
+            f"↔️ Предыдущий период ({_format_date(period.previous.start)} - "
+            f"{_format_date(period.previous.end)}): {format_amount(previous_cents)} руб.\n"
+        )
+    if not totals:
+        response += "\n📭 За этот период расходов нет.\n"
+        return response
+
+    response += "\n📁 Расходы по категориям:\n"
+    for category, amount, _ in totals:
+        percentage = (amount / total_cents * 100) if total_cents > 0 else 0
+        response += f"• {category}: {format_amount(amount)} руб. ({percentage:.1f}%)"
+        if compare:
+            response += _change(amount, previous.get(category, 0))
+        response += "\n"
+    return response
@@ -0,0 +1,588 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+# Нагрузочный прогон бота без токена и сети: настоящий диспетчер из bot.py
+# работает против локальной заглушки Bot API, а обновления подаются
+# напрямую в dp.feed_raw_update. База заранее заполняется синтетическими
+# расходами. Для каждого сценария считаются пропускная способность,
+# p50/p99 задержки и пиковая память (вместе с процессами отчётов).
+#
+#   python benchmark.py --rows 100000 --users 1000
+#   python benchmark.py --save-baseline baseline.json
+#   python benchmark.py --baseline baseline.json --tolerance 0.2
+
+SCENARIOS = (
+    "add_expense", "statistics", "statistics_periods", "history", "search",
+    "export_excel", "export_pdf", "export_worker", "import_csv",
+)
+# Экспорт и импорт одного пользователя идут строго по одному, поэтому эти сценарии последовательны
+SEQUENTIAL_SCENARIOS = ("export_excel", "export_pdf", "export_worker", "import_csv")
+
+EXPORT_USER_ID = 10 ** 9
+IMPORT_USER_ID = 10 ** 9 + 1
+IMPORT_FILE_ID = "import.csv"
+BENCH_TOKEN = "123456:BENCHMARK"
+SEED_CHUNK = 100000
+HISTORY_PAGES = 3
+SEARCH_PAGES = 2
+# Сколько ждать отчёта от рабочего процесса, секунд
+WORKER_EXPORT_TIMEOUT = 120
+# Описания синтетических расходов: по ним ищет сценарий search
+SEED_DESCRIPTIONS = (
+    "Такси до работы", "Продукты в магазине", "Кофе с собой", "Обед в столовой",
+    "Бензин", "Аптека", "Кино с друзьями", "Подарок маме", "Интернет", "Книга",
+)
+SEARCH_QUERIES = ("такси", "продукты", "подарок маме", "кофе")
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отвечает на запросы бота правдоподобными объектами."""
+
+    def __init__(self):
+        self.requests = 0
+        self.uploaded_bytes = 0
+        self.documents = 0
+        self.markups = {}
+        self.files = {}
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    def _message(self, chat_id, **extra):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        message.update(extra)
+        return message
+
+    async def handle(self, request):
+        self.requests += 1
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        chat_id = int(form["chat_id"]) if "chat_id" in form else 0
+        if "reply_markup" in form:
+            self.markups[chat_id] = json.loads(form["reply_markup"])
+
+        if method == "senddocument":
+            document = form["document"]
+            if isinstance(document, web.FileField):
+                self.uploaded_bytes += len(document.file.read())
+            self.documents += 1
+            file_id = f"file{self.requests}"
+            result = self._message(chat_id, document={"file_id": file_id, "file_unique_id": file_id})
+        elif method in ("sendmessage", "editmessagetext"):
+            result = self._message(chat_id, text=form.get("text", ""))
+        elif method == "getfile":
+            file_id = form["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_path": file_id}
+        elif method == "getme":
+            result = {"id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def handle_file(self, request):
+        return web.FileResponse(self.files[request.match_info["path"]])
+
+    async def start(self, host="127.0.0.1"):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path}", self.handle_file)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def prepare_environment(workdir, api_url, limits):
+    # Настройки применяются до импорта bot.py: конфигурация читается при импорте
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.db")
+    os.environ["EXPORT_CACHE_DIR"] = os.path.join(workdir, "export_cache")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["WORKER_PROCESSES"] = "1"
+    if not limits:
+        # Лимиты Telegram и защита от частых нажатий мерили бы сами себя
+        for name in ("SEND_GLOBAL_RATE", "SEND_CHAT_RATE", "SEND_CHAT_BURST", "THROTTLE_RATE", "THROTTLE_BURST"):
+            os.environ[name] = "1000000"
+        os.environ["CALLBACK_DEDUP_WINDOW"] = "0"
+
+
+def seed_database(router, categories, users, rows, export_rows):
+    """Заполняет шарды расходами: rows на users пользователей плюс export_rows у одного."""
+    now = datetime.now()
+    owners = [(user_id, rows // users + (1 if user_id <= rows % users else 0)) for user_id in range(1, users + 1)]
+    owners.append((EXPORT_USER_ID, export_rows))
+    by_path = {}
+    for user_id, count in owners:
+        by_path.setdefault(router.path_for(user_id), []).append((user_id, count))
+
+    import search
+
+    for path, shard_owners in by_path.items():
+        conn = sqlite3.connect(path)
+        # Поисковый индекс строится одним запросом после вставки, как при импорте
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM expenses").fetchone()[0]
+        conn.execute(search.PAUSE_INDEXING)
+        batch = []
+        for user_id, count in shard_owners:
+            for _ in range(count):
+                date = now - timedelta(minutes=random.randint(0, 90 * 24 * 60))
+                batch.append((
+                    user_id,
+                    random.randint(5000, 500000),
+                    random.choice(categories),
+                    random.choice(SEED_DESCRIPTIONS),
+                    date.strftime("%Y-%m-%d %H:%M:%S"),
+                ))
+                if len(batch) >= SEED_CHUNK:
+                    conn.executemany(
+                        "INSERT INTO expenses (user_id, amount_cents, category, description, date) VALUES (?, ?, ?, ?, ?)",
+                        batch
+                    )
+                    batch = []
+        if batch:
+            conn.executemany(
+                "INSERT INTO expenses (user_id, amount_cents, category, description, date) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+        conn.execute(search.INDEX_NEW_EXPENSES, (last_id,))
+        conn.execute(search.RESUME_INDEXING)
+        conn.commit()
+        conn.close()
+
+
+def write_import_file(path, categories, rows):
+    """CSV в формате выгрузки: Дата;Сумма;Категория;Описание."""
+    now = datetime.now()
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Дата", "Сумма", "Категория", "Описание"])
+        for i in range(rows):
+            writer.writerow([
+                (now - timedelta(minutes=i)).strftime("%d.%m.%Y %H:%M"),
+                f"{random.uniform(10, 5000):.2f}".replace(".", ","),
+                random.choice(categories),
+                f"Импорт {i}",
+            ])
+    return os.path.getsize(path)
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def current_rss_mb():
+    # Бот и его процессы отчётов вместе
+    pids = [os.getpid()] + [process.pid for process in multiprocessing.active_children()]
+    total = sum(_rss_kb(pid) for pid in pids)
+    if not total:
+        # Без /proc доступен только пик текущего процесса
+        total = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return total / 1024
+
+
+STARTUP_PROBE = """
+import time
+started = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - started
+with open("/proc/self/status") as status:
+    rss = next((int(line.split()[1]) for line in status if line.startswith("VmRSS:")), 0)
+print(elapsed, rss)
+"""
+
+
+def measure_startup(runs=3):
+    """Импорт bot.py в чистом интерпретаторе: время (медиана) и память после импорта."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=os.environ.copy(),
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.split()
+        samples.append((float(output[-2]), int(output[-1])))
+    samples.sort()
+    seconds, rss_kb = samples[len(samples) // 2]
+    return {"import_seconds": round(seconds, 3), "rss_mb": round(rss_kb / 1024, 1)}
+
+
+def run_bench_worker(index, queue, heartbeat):
+    # Рабочий процесс супервизора, журнал как у самого бенчмарка
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(bot.worker_main(index, queue, heartbeat))
+
+
+class Driver:
+    """Собирает обновления Telegram и прогоняет их через диспетчер бота."""
+
+    def __init__(self, bot_module, api, supervisor=None):
+        self.bot = bot_module
+        self.api = api
+        self.supervisor = supervisor
+        self._update_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Bench"}
+
+    async def text(self, user_id, text):
+        update_id = next(self._update_ids)
+        await self.bot.dp.feed_raw_update(self.bot.bot, {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        })
+
+    def _callback_update(self, user_id, data):
+        update_id = next(self._update_ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": "benchmark",
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "-",
+                },
+            },
+        }
+
+    async def callback(self, user_id, data):
+        await self.bot.dp.feed_raw_update(self.bot.bot, self._callback_update(user_id, data))
+
+    async def add_expense(self, user_id):
+        await self.text(user_id, "➕ Добавить расход")
+        await self.text(user_id, f"{random.uniform(50, 5000):.2f}")
+        await self.callback(user_id, "category_" + random.choice(list(self.bot.CATEGORIES.values())))
+        await self.text(user_id, "Расход из бенчмарка")
+
+    async def statistics(self, user_id):
+        await self.text(user_id, "📊 Статистика")
+
+    async def statistics_periods(self, user_id):
+        # Переключение периодов: год и всё время читаются из месячных и недельных итогов
+        for key in ("year", "all", "prev_month"):
+            await self.callback(user_id, f"stats:{key}")
+
+    async def history(self, user_id):
+        await self.text(user_id, "📝 История")
+        for _ in range(HISTORY_PAGES):
+            data = self._next_page(user_id)
+            if data is None:
+                break
+            await self.callback(user_id, data)
+
+    async def search(self, user_id):
+        await self.text(user_id, f"/search {random.choice(SEARCH_QUERIES)}")
+        for _ in range(SEARCH_PAGES):
+            data = self._next_page(user_id, "search:")
+            if data is None:
+                break
+            await self.callback(user_id, data)
+
+    def _next_page(self, user_id, prefix="page:view:"):
+        # Кнопка перехода на следующую страницу в последнем сообщении пользователя
+        markup = self.api.markups.get(user_id) or {}
+        for row in markup.get("inline_keyboard", []):
+            for button in row:
+                if button.get("callback_data", "").startswith(prefix) and "➡️" in button.get("text", ""):
+                    return button["callback_data"]
+        return None
+
+    async def export(self, user_id, kind):
+        # Каждый замер - холодный: без готового файла и file_id в кэше
+        self.bot.export_cache.clear()
+        await self.callback(EXPORT_USER_ID, f"export_{kind}")
+
+    async def export_excel(self, user_id):
+        await self.export(user_id, "excel")
+
+    async def export_pdf(self, user_id):
+        await self.export(user_id, "pdf")
+
+    async def export_worker(self, user_id):
+        # Экспорт в рабочем процессе супервизора: отчёт собирается в пуле процессов,
+        # запущенном уже из рабочего процесса. Версия данных повышается, чтобы
+        # каждый замер был холодным
+        from database import bump_data_version
+        await self.bot.router.submit(EXPORT_USER_ID, lambda conn: bump_data_version(conn, EXPORT_USER_ID))
+        documents = self.api.documents
+        self.supervisor.route(self._callback_update(EXPORT_USER_ID, "export_excel"))
+        deadline = time.perf_counter() + WORKER_EXPORT_TIMEOUT
+        while self.api.documents == documents:
+            if time.perf_counter() > deadline or not self.supervisor.stats()["alive"]:
+                raise RuntimeError("Рабочий процесс не прислал отчёт")
+            await asyncio.sleep(0.01)
+
+    async def import_csv(self, user_id):
+        await self.text(IMPORT_USER_ID, "📤 Импорт")
+        update_id = next(self._update_ids)
+        await self.bot.dp.feed_raw_update(self.bot.bot, {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": IMPORT_USER_ID, "type": "private"},
+                "from": self._user(IMPORT_USER_ID),
+                "document": {
+                    "file_id": IMPORT_FILE_ID,
+                    "file_unique_id": IMPORT_FILE_ID,
+                    "file_name": IMPORT_FILE_ID,
+                    "file_size": os.path.getsize(self.api.files[IMPORT_FILE_ID]),
+                },
+            },
+        })
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_scenario(driver, name, user_ids, concurrency, iterations):
+    action = getattr(driver, name)
+    if name in SEQUENTIAL_SCENARIOS:
+        concurrency = 1
+    latencies = []
+    peak_rss = current_rss_mb()
+    requests_before = driver.api.requests
+
+    async def virtual_user(index):
+        for step in range(iterations):
+            user_id = user_ids[(index * iterations + step) % len(user_ids)]
+            started = time.perf_counter()
+            await action(user_id)
+            latencies.append(time.perf_counter() - started)
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, current_rss_mb())
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample_memory())
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user(index) for index in range(concurrency)))
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+    peak_rss = max(peak_rss, current_rss_mb())
+
+    latencies.sort()
+    return {
+        "operations": len(latencies),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0,
+        "api_requests": driver.api.requests - requests_before,
+        "peak_rss_mb": round(peak_rss, 1),
+    }
+
+
+def compare(startup, results, baseline, tolerance):
+    """Возвращает список регрессий относительно сохранённых результатов."""
+    regressions = []
+    base = baseline.get("startup")
+    if base:
+        if startup["import_seconds"] > base["import_seconds"] * (1 + tolerance):
+            regressions.append(f"запуск: импорт {startup['import_seconds']} с > {base['import_seconds']} с")
+        if startup["rss_mb"] > base["rss_mb"] * (1 + tolerance):
+            regressions.append(f"запуск: память {startup['rss_mb']} МБ > {base['rss_mb']} МБ")
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        if base["throughput"] and result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: пропускная способность {result['throughput']} < {base['throughput']}")
+        if base["p99_ms"] and result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_ms']} мс > {base['p99_ms']} мс")
+        if base["peak_rss_mb"] and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: память {result['peak_rss_mb']} МБ > {base['peak_rss_mb']} МБ")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    header = f"{'сценарий':<20}{'опер.':>8}{'опер./с':>10}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}{'RSS, МБ':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        print(
+            f"{name:<20}{result['operations']:>8}{result['throughput']:>10}"
+            f"{result['p50_ms']:>10}{result['p99_ms']:>10}{result['max_ms']:>10}{result['peak_rss_mb']:>10}"
+        )
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base:
+            print(
+                f"{'  база':<20}{base['operations']:>8}{base['throughput']:>10}"
+                f"{base['p50_ms']:>10}{base['p99_ms']:>10}{base['max_ms']:>10}{base['peak_rss_mb']:>10}"
+            )
+
+
+async def run(args):
+    api = FakeBotAPI()
+    api_url = await api.start()
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    prepare_environment(workdir, api_url, args.limits)
+    startup = measure_startup()
+
+    import bot as bot_module
+    import rollups
+    from workers import Supervisor
+
+    # Журнал каждого обновления исказил бы замеры
+    logging.getLogger().setLevel(logging.WARNING)
+
+    metrics_runner = await bot_module.start_services(metrics_port=0)
+    supervisor = None
+    try:
+        started = time.perf_counter()
+        seed_database(
+            bot_module.router, list(bot_module.CATEGORIES.values()),
+            args.users, args.rows, args.export_rows
+        )
+        for db in bot_module.router.databases:
+            async with db.writer() as conn:
+                await conn.execute("BEGIN")
+                await rollups.backfill(conn)
+        print(
+            f"База заполнена за {time.perf_counter() - started:.1f} с: "
+            f"{args.rows} расходов у {args.users} пользователей, {args.export_rows} у экспортирующего"
+        )
+
+        if "import_csv" in args.scenarios:
+            import_path = os.path.join(workdir, IMPORT_FILE_ID)
+            write_import_file(import_path, list(bot_module.CATEGORIES.values()), args.import_rows)
+            api.files[IMPORT_FILE_ID] = import_path
+
+        if "export_worker" in args.scenarios:
+            # Один рабочий процесс, как в многопроцессном режиме бота
+            supervisor = Supervisor(run_bench_worker, 1)
+            supervisor.start()
+        driver = Driver(bot_module, api, supervisor)
+        if supervisor is not None:
+            # Первый экспорт ждёт запуска рабочего процесса и в замер не входит
+            await driver.export_worker(EXPORT_USER_ID)
+
+        user_ids = list(range(1, args.users + 1))
+        results = {}
+        for name in args.scenarios:
+            results[name] = await run_scenario(driver, name, user_ids, args.concurrency, args.iterations)
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+        await bot_module.stop_services(metrics_runner)
+        await bot_module.bot.session.close()
+        await api.stop()
+    return startup, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против заглушки Bot API")
+    parser.add_argument("--rows", type=int, default=10000, help="расходов в базе у обычных пользователей")
+    parser.add_argument("--users", type=int, default=100, help="число пользователей в базе")
+    parser.add_argument("--export-rows", type=int, default=10000, help="расходов у пользователя для экспорта")
+    parser.add_argument("--import-rows", type=int, default=10000, help="строк в файле для импорта")
+    parser.add_argument("--concurrency", type=int, default=10, help="одновременных виртуальных пользователей")
+    parser.add_argument("--iterations", type=int, default=20, help="повторов сценария на пользователя")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--limits", action="store_true", help="не отключать лимиты отправки и частоты запросов")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--save-baseline", help="сохранить результаты как базовые для сравнения")
+    parser.add_argument("--baseline", help="сравнить с базовыми результатами")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    startup, results = asyncio.run(run(args))
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "params": {
+            "rows": args.rows,
+            "users": args.users,
+            "export_rows": args.export_rows,
+            "import_rows": args.import_rows,
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+        },
+        "startup": startup,
+        "scenarios": results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print()
+    print(f"Запуск: импорт bot.py {startup['import_seconds']} с, память после импорта {startup['rss_mb']} МБ")
+    if baseline and baseline.get("startup"):
+        base = baseline["startup"]
+        print(f"  база: импорт {base['import_seconds']} с, память {base['rss_mb']} МБ")
+    print()
+    print_table(results, baseline)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        if baseline.get("params") != report["params"]:
+            print("\n⚠️ Параметры прогона отличаются от базовых, сравнение может быть некорректным")
+        regressions = compare(startup, results, baseline, args.tolerance)
+        if regressions:
+            print("\nРегрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
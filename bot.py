@@ -1,24 +1,51 @@
 import asyncio
 import logging
+import time
+# Отсчёт времени запуска: от начала импорта модулей до готовности служб
+STARTED_AT = time.perf_counter()
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-import aiosqlite
 import os
-from datetime import datetime, timedelta
+import tempfile
+from datetime import datetime
 from dotenv import load_dotenv
-from config import ExpenseStates
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.utils import get_column_letter
-from io import BytesIO
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
+from config import (
+    ExpenseStates, DB_PATH, DB_READERS, DB_SHARDS, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_MS,
+    AMOUNT_MIGRATION_BATCH, AMOUNT_MIGRATION_PAUSE_MS,
+    CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL,
+    REPORT_WORKERS, REPORT_MAX_CONCURRENT, REPORT_MAX_QUEUE, REPORT_TIMEOUT, REPORT_PREWARM,
+    IMPORT_MAX_FILE_SIZE, IMPORT_MAX_ROWS, IMPORT_BATCH_SIZE, IMPORT_MAX_CONCURRENT, IMPORT_PROGRESS_INTERVAL,
+    EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, FSM_CACHE_SIZE, FSM_STATE_TTL,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENT,
+    WORKER_PROCESSES, WORKER_HEALTH_INTERVAL, WORKER_HEALTH_TIMEOUT,
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_GROUP_RATE_PER_MIN, SEND_MAX_RETRIES,
+    THROTTLE_RATE, THROTTLE_BURST, CALLBACK_DEDUP_WINDOW, METRICS_HOST, METRICS_PORT,
+    TELEGRAM_API_URL
+)
+from cache import ResponseCache
+from database import StorageProfile, bump_data_version, get_data_version
+from export_cache import ExportCache
+import metrics
+from middlewares import ThrottlingMiddleware
+from send_queue import SendScheduler
+from storage import SQLiteStorage
+from webhook import run_webhook
+from workers import Supervisor, consume_updates, poll_updates
+from sharding import ShardRouter
+import rollups
+import analytics
+import history
+import importer
+import search
+import budgets
+import money
+from reports import REPORT_SUFFIXES, ReportService, ReportQueueFull, ReportTimeout
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -26,9 +53,74 @@ load_dotenv()
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=os.getenv("BOT_TOKEN"))
-dp = Dispatcher()
+# Инициализация бота
+if TELEGRAM_API_URL:
+    bot = Bot(token=os.getenv("BOT_TOKEN"), session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=os.getenv("BOT_TOKEN"))
+# Все исходящие запросы идут через планировщик с лимитами Telegram.
+# Рабочие процессы делят общий лимит бота поровну
+send_scheduler = SendScheduler(
+    global_rate=SEND_GLOBAL_RATE / max(1, WORKER_PROCESSES),
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    group_rate=SEND_GROUP_RATE_PER_MIN / 60,
+    max_retries=SEND_MAX_RETRIES
+)
+bot.session.middleware(send_scheduler)
+
+# Кэш готовых ответов статистики, истории и результатов поиска
+response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL)
+def forget_users(users):
+    # Данные перенесены в другой шард: id записей в кэшированных ответах устарели
+    for user_id in users:
+        response_cache.invalidate_user(user_id)
+
+# Шарды базы данных: у каждого пул соединений и очередь записи с групповой фиксацией
+router = ShardRouter(
+    DB_PATH,
+    shards=DB_SHARDS,
+    readers=DB_READERS,
+    max_batch=WRITE_BATCH_SIZE,
+    max_delay=WRITE_BATCH_DELAY_MS / 1000,
+    on_moved=forget_users,
+    profile=StorageProfile.from_config()
+)
+# Пул процессов для формирования отчетов Excel и PDF
+report_service = ReportService(
+    max_workers=REPORT_WORKERS,
+    max_concurrent=REPORT_MAX_CONCURRENT,
+    max_queue=REPORT_MAX_QUEUE,
+    timeout=REPORT_TIMEOUT
+)
+# Кэш готовых отчетов по версии данных пользователя
+export_cache = ExportCache(EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES)
+# Состояния FSM хранятся в SQLite и переживают перезапуск бота
+storage = SQLiteStorage(router.main_db, router.main_queue, max_entries=FSM_CACHE_SIZE, ttl=FSM_STATE_TTL)
+
+# Инициализация диспетчера
+dp = Dispatcher(storage=storage)
+# Лимит запросов, защита от двойных нажатий и одного экспорта за раз
+throttling = ThrottlingMiddleware(rate=THROTTLE_RATE, burst=THROTTLE_BURST, dedup_window=CALLBACK_DEDUP_WINDOW)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+# Время работы каждого обработчика
+dp.message.middleware(metrics.HandlerTimingMiddleware())
+dp.callback_query.middleware(metrics.HandlerTimingMiddleware())
+
+# Импорт файлов: разбор идёт в потоках, поэтому одновременных импортов немного
+import_semaphore = asyncio.Semaphore(IMPORT_MAX_CONCURRENT)
+
+# Счётчики компонентов на эндпоинте /metrics
+metrics.register_stats("bot_response_cache", response_cache.stats)
+metrics.register_stats("bot_reports", report_service.stats)
+metrics.register_stats("bot_export_cache", export_cache.stats)
+metrics.register_stats("bot_send", send_scheduler.stats)
+metrics.register_stats("bot_throttling", throttling.stats)
+
+# Время запуска, заполняется в start_services
+startup = {}
+metrics.register_stats("bot_startup", lambda: startup)
 
 # Создание клавиатуры
 main_keyboard = ReplyKeyboardMarkup(
@@ -44,6 +136,11 @@ main_keyboard = ReplyKeyboardMarkup(
         [
             KeyboardButton(text="❌ Удалить"),
             KeyboardButton(text="📥 Экспорт")
+        ],
+        [
+            KeyboardButton(text="📤 Импорт"),
+            KeyboardButton(text="🔍 Поиск"),
+            KeyboardButton(text="🎯 Бюджеты")
         ]
     ],
     resize_keyboard=True
@@ -90,6 +187,29 @@ def get_edit_fields_keyboard():
         ]
     )
 
+# Клавиатуры не меняются, поэтому строятся один раз при запуске
+categories_keyboard = get_categories_keyboard()
+edit_fields_keyboard = get_edit_fields_keyboard()
+
+# Клавиатура с кнопкой отмены
+cancel_keyboard = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text="❌ Отмена")]],
+    resize_keyboard=True
+)
+
+# Клавиатура для выбора формата экспорта
+export_keyboard = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📊 Excel", callback_data="export_excel"),
+            InlineKeyboardButton(text="📄 PDF", callback_data="export_pdf")
+        ],
+        [
+            InlineKeyboardButton(text="❌ Отмена", callback_data="export_cancel")
+        ]
+    ]
+)
+
 @dp.message(Command("start")) # приветствие бота
 async def cmd_start(message: types.Message):
     await message.answer(
@@ -99,17 +219,16 @@ async def cmd_start(message: types.Message):
         "📊 Статистика - посмотреть расходы за месяц\n"
         "📝 История - посмотреть последние записи\n"
         "✏️ Редактировать - изменить существующую запись\n"
-        "❌ Удалить - удалить запись\n\n"
+        "❌ Удалить - удалить запись\n"
+        "📤 Импорт - загрузить расходы из CSV или Excel\n"
+        "🔍 Поиск - найти расходы по описанию, например /search такси\n"
+        "🎯 Бюджеты - месячные лимиты по категориям с предупреждениями\n\n"
         "Выберите действие:",
         reply_markup=main_keyboard
     )
 
 @dp.message(F.text == "➕ Добавить расход")
 async def add_expense(message: types.Message, state: FSMContext):
-    cancel_keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="❌ Отмена")]],
-        resize_keyboard=True
-    )
     await message.answer(
         "💵 Введите сумму расхода в рублях.\n"
         "Например: 1500 или 99.99",
@@ -129,13 +248,11 @@ async def process_amount(message: types.Message, state: FSMContext):
         return
 
     try:
-        amount = float(message.text)
-        if amount <= 0:
-            raise ValueError
-        await state.update_data(amount=amount)
+        amount_cents = money.parse_amount(message.text)
+        await state.update_data(amount_cents=amount_cents)
         await message.answer(
             "📁 Выберите категорию расхода:",
-            reply_markup=get_categories_keyboard()
+            reply_markup=categories_keyboard
         )
         await state.set_state(ExpenseStates.waiting_for_category)
     except ValueError:
@@ -164,10 +281,6 @@ async def process_category(callback: types.CallbackQuery, state: FSMContext):
     try:
         category = callback.data.split("_")[1]
         await state.update_data(category=category)
-        cancel_keyboard = ReplyKeyboardMarkup(
-            keyboard=[[KeyboardButton(text="❌ Отмена")]],
-            resize_keyboard=True
-        )
         await callback.message.answer(
             "📝 Введите описание расхода.\n"
             "Например: Обед в кафе или Проезд на метро",
@@ -192,7 +305,7 @@ async def process_description(message: types.Message, state: FSMContext):
 
     try:
         data = await state.get_data()
-        if "amount" not in data or "category" not in data:
+        if "amount_cents" not in data or "category" not in data:
             await message.answer(
                 "❌ Произошла ошибка. Пожалуйста, начните добавление расхода заново.",
                 reply_markup=main_keyboard
@@ -200,19 +313,30 @@ async def process_description(message: types.Message, state: FSMContext):
             await state.clear()
             return
 
-        async with aiosqlite.connect("expenses.db") as db:
-            await db.execute(
-                "INSERT INTO expenses (user_id, amount, category, description) VALUES (?, ?, ?, ?)",
-                (message.from_user.id, data["amount"], data["category"], message.text)
+        async def insert_expense(conn):
+            cursor = await conn.execute(
+                "INSERT INTO expenses (user_id, amount_cents, category, description) VALUES (?, ?, ?, ?)",
+                (message.from_user.id, data["amount_cents"], data["category"], message.text)
             )
-            await db.commit()
+            change = await rollups.apply_expense(conn, cursor.lastrowid, message.from_user.id, 1)
+            await bump_data_version(conn, message.from_user.id)
+            # Порог бюджета проверяется по месячному итогу до и после вставки
+            return await budgets.check_change(conn, message.from_user.id, change)
         
-        await message.answer(
+        # Ответ отправляется только после фиксации транзакции с этой записью
+        alert = await router.submit(message.from_user.id, insert_expense)
+        response_cache.invalidate_user(message.from_user.id)
+        
+        response = (
             "✅ Расход успешно добавлен!\n\n"
-            f"💰 Сумма: {data['amount']:.2f} руб.\n"
+            f"💰 Сумма: {money.format_amount(data['amount_cents'])} руб.\n"
             f"📁 Категория: {data['category']}\n"
             f"📝 Описание: {message.text}\n\n"
-            "Выберите следующее действие:",
+        )
+        if alert:
+            response += f"{alert}\n\n"
+        await message.answer(
+            response + "Выберите следующее действие:",
             reply_markup=main_keyboard
         )
     except Exception as e:
@@ -220,91 +344,112 @@ async def process_description(message: types.Message, state: FSMContext):
     finally:
         await state.clear()
 
+async def statistics_report(user_id, period):
+    """Текст и клавиатура статистики за период; готовые ответы берутся из кэша."""
+    cached = response_cache.get(user_id, period.cache_view)
+    if cached is not None:
+        return cached
+    
+    generation = response_cache.generation(user_id)
+    async with router.reader(user_id) as conn:
+        # Итоги собираются из дневных, недельных и месячных корзин
+        totals = await analytics.fetch_totals(conn, user_id, period.start, period.end)
+        previous = None
+        if period.previous is not None:
+            previous = await analytics.fetch_totals(conn, user_id, period.previous.start, period.previous.end)
+    
+    reply = (analytics.build_report(period, totals, previous), analytics.period_keyboard())
+    response_cache.set(user_id, period.cache_view, reply, generation)
+    return reply
+
 @dp.message(F.text == "📊 Статистика")
 async def show_statistics(message: types.Message):
-    async with aiosqlite.connect("expenses.db") as db:
-        # Статистика за последние 30 дней
-        thirty_days_ago = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-        
-        # Общая сумма расходов
-        total = await db.execute_fetchall(
-            "SELECT SUM(amount) FROM expenses WHERE user_id = ? AND date >= ?",
-            (message.from_user.id, thirty_days_ago)
+    # По умолчанию - последние 30 дней, другой период выбирается кнопками
+    text, reply_markup = await statistics_report(message.from_user.id, analytics.resolve_period("30d"))
+    await message.answer(text, reply_markup=reply_markup)
+
+@dp.callback_query(F.data.startswith(analytics.STATS_PREFIX))
+async def process_statistics_period(callback: types.CallbackQuery, state: FSMContext):
+    key = callback.data[len(analytics.STATS_PREFIX):]
+    if key == "custom":
+        await callback.message.answer(
+            "📅 Введите период в формате 01.01.2024-31.03.2024\n"
+            "или одну дату, например 15.03.2024",
+            reply_markup=cancel_keyboard
         )
-        total_amount = total[0][0] or 0
-        
-        # Статистика по категориям
-        categories = await db.execute_fetchall(
-            "SELECT category, SUM(amount) FROM expenses WHERE user_id = ? AND date >= ? GROUP BY category",
-            (message.from_user.id, thirty_days_ago)
+        await state.set_state(ExpenseStates.waiting_for_stats_period)
+        await callback.answer()
+        return
+    
+    try:
+        period = analytics.resolve_period(key)
+    except ValueError:
+        await callback.answer("❌ Неизвестный период")
+        return
+    
+    text, reply_markup = await statistics_report(callback.from_user.id, period)
+    try:
+        await callback.message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest:
+        # Тот же период выбран повторно: сообщение не изменилось
+        pass
+    await callback.answer()
+
+@dp.message(ExpenseStates.waiting_for_stats_period)
+async def process_statistics_custom(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await message.answer(
+            "❌ Выбор периода отменен.\n"
+            "Выберите другое действие:",
+            reply_markup=main_keyboard
         )
-        
-        response = "📊 Статистика расходов за последние 30 дней:\n\n"
-        response += f"💰 Общая сумма: {total_amount:.2f} руб.\n\n"
-        response += "📁 Расходы по категориям:\n"
-        
-        for category, amount in categories:
-            percentage = (amount / total_amount * 100) if total_amount > 0 else 0
-            response += f"• {category}: {amount:.2f} руб. ({percentage:.1f}%)\n"
-        
-        await message.answer(response)
+        await state.clear()
+        return
+    
+    try:
+        period = analytics.parse_custom_period(message.text)
+    except ValueError:
+        await message.answer(
+            "❌ Пожалуйста, введите период в формате 01.01.2024-31.03.2024"
+        )
+        return
+    
+    await state.clear()
+    text, reply_markup = await statistics_report(message.from_user.id, period)
+    await message.answer(text, reply_markup=reply_markup)
+    await message.answer("Выберите следующее действие:", reply_markup=main_keyboard)
 
 @dp.message(F.text == "📝 История")
 async def show_history(message: types.Message):
-    async with aiosqlite.connect("expenses.db") as db:
-        expenses = await db.execute_fetchall(
-            "SELECT id, amount, category, description, date FROM expenses WHERE user_id = ? ORDER BY date DESC LIMIT 10",
-            (message.from_user.id,)
-        )
-        
-        if not expenses:
-            await message.answer("📭 У вас пока нет записей о расходах.")
-            return
-        
-        response = "📝 Последние 10 расходов:\n\n"
-        for expense_id, amount, category, description, date in expenses:
-            response += f"🆔 ID: {expense_id}\n"
-            response += f"💰 Сумма: {amount:.2f} руб.\n"
-            response += f"📁 Категория: {category}\n"
-            response += f"📝 Описание: {description}\n"
-            response += f"📅 Дата: {date}\n\n"
+    cached = response_cache.get(message.from_user.id, "history")
+    if cached is not None:
+        text, reply_markup = cached
+        await message.answer(text, reply_markup=reply_markup)
+        return
+    
+    generation = response_cache.generation(message.from_user.id)
+    async with router.reader(message.from_user.id) as conn:
+        expenses, has_next = await history.fetch_page(conn, message.from_user.id, "view")
         
-        await message.answer(response)
+    if not expenses:
+        await message.answer("📭 У вас пока нет записей о расходах.")
+        return
+    
+    response, reply_markup = history.build_page("view", expenses, 1, False, has_next)
+    response_cache.set(message.from_user.id, "history", (response, reply_markup), generation)
+    await message.answer(response, reply_markup=reply_markup)
 
 @dp.message(F.text == "✏️ Редактировать")
 async def edit_expense(message: types.Message):
-    async with aiosqlite.connect("expenses.db") as db:
-        expenses = await db.execute_fetchall(
-            "SELECT id, amount, category, description, date FROM expenses WHERE user_id = ? ORDER BY date DESC LIMIT 5",
-            (message.from_user.id,)
-        )
-        
-        if not expenses:
-            await message.answer("📭 У вас пока нет записей для редактирования.")
-            return
-        
-        response = "📝 Выберите запись для редактирования:\n\n"
-        keyboard = []
-        for expense_id, amount, category, description, date in expenses:
-            response += f"🆔 ID: {expense_id}\n"
-            response += f"💰 Сумма: {amount:.2f} руб.\n"
-            response += f"📁 Категория: {category}\n"
-            response += f"📅 Дата: {date}\n\n"
-            
-            keyboard.append([InlineKeyboardButton(
-                text=f"ID: {expense_id} | {amount:.2f} руб. | {category}",
-                callback_data=f"edit_select_{expense_id}"
-            )])
-        
-        keyboard.append([InlineKeyboardButton(
-            text="❌ Отмена",
-            callback_data="edit_cancel"
-        )])
+    async with router.reader(message.from_user.id) as conn:
+        expenses, has_next = await history.fetch_page(conn, message.from_user.id, "edit")
         
-        await message.answer(
-            response,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
-        )
+    if not expenses:
+        await message.answer("📭 У вас пока нет записей для редактирования.")
+        return
+    
+    response, reply_markup = history.build_page("edit", expenses, 1, False, has_next)
+    await message.answer(response, reply_markup=reply_markup)
 
 @dp.callback_query(F.data.startswith("edit_select_"))
 async def process_edit_selection(callback: types.CallbackQuery, state: FSMContext):
@@ -313,7 +458,7 @@ async def process_edit_selection(callback: types.CallbackQuery, state: FSMContex
     
     await callback.message.answer(
         "✏️ Выберите, что хотите изменить:",
-        reply_markup=get_edit_fields_keyboard()
+        reply_markup=edit_fields_keyboard
     )
     await state.set_state(ExpenseStates.waiting_for_edit_field)
     await callback.answer()
@@ -350,7 +495,7 @@ async def process_edit_field(callback: types.CallbackQuery, state: FSMContext):
         if action == "category":
             await callback.message.answer(
                 "📁 Выберите новую категорию:",
-                reply_markup=get_categories_keyboard()
+                reply_markup=categories_keyboard
             )
         else:
             field_name = {
@@ -365,6 +510,13 @@ async def process_edit_field(callback: types.CallbackQuery, state: FSMContext):
     finally:
         await callback.answer()
 
+# Изменяемые поля записи: сумма пишется в копейках, старое значение amount больше не нужно
+EDIT_COLUMNS = {
+    "amount": "amount_cents = ?, amount = NULL",
+    "category": "category = ?",
+    "description": "description = ?",
+}
+
 @dp.message(ExpenseStates.waiting_for_edit_value)
 async def process_edit_value(message: types.Message, state: FSMContext):
     try:
@@ -381,18 +533,23 @@ async def process_edit_value(message: types.Message, state: FSMContext):
         field = data["edit_field"]
         
         if field == "amount":
-            value = float(message.text)
-            if value <= 0:
-                raise ValueError
+            value = money.parse_amount(message.text)
         else:
             value = message.text
         
-        async with aiosqlite.connect("expenses.db") as db:
-            await db.execute(
-                f"UPDATE expenses SET {field} = ? WHERE id = ? AND user_id = ?",
+        async def update_expense(conn):
+            # Переносим запись в итогах: старое значение вычитаем, новое прибавляем
+            removed = await rollups.apply_expense(conn, expense_id, message.from_user.id, -1)
+            await conn.execute(
+                f"UPDATE expenses SET {EDIT_COLUMNS[field]} WHERE id = ? AND user_id = ?",
                 (value, expense_id, message.from_user.id)
             )
-            await db.commit()
+            added = await rollups.apply_expense(conn, expense_id, message.from_user.id, 1)
+            await bump_data_version(conn, message.from_user.id)
+            return await budgets.check_change(conn, message.from_user.id, budgets.edit_change(removed, added))
+        
+        alert = await router.submit(message.from_user.id, update_expense)
+        response_cache.invalidate_user(message.from_user.id)
         
         field_name = {
             "amount": "Сумма",
@@ -400,11 +557,17 @@ async def process_edit_value(message: types.Message, state: FSMContext):
             "description": "Описание"
         }.get(field, field)
         
-        await message.answer(
+        if field == "amount":
+            value = f"{money.format_amount(value)} руб."
+        response = (
             "✅ Запись успешно обновлена!\n\n"
             f"🆔 ID: {expense_id}\n"
             f"📝 {field_name}: {value}\n\n"
-            "Выберите следующее действие:",
+        )
+        if alert:
+            response += f"{alert}\n\n"
+        await message.answer(
+            response + "Выберите следующее действие:",
             reply_markup=main_keyboard
         )
     except ValueError:
@@ -418,42 +581,21 @@ async def process_edit_value(message: types.Message, state: FSMContext):
 
 @dp.message(F.text == "❌ Удалить")
 async def delete_expense(message: types.Message):
-    async with aiosqlite.connect("expenses.db") as db:
-        # Получаем последние 10 расходов
-        expenses = await db.execute_fetchall(
-            "SELECT id, amount, category, description, date FROM expenses WHERE user_id = ? ORDER BY date DESC LIMIT 10",
-            (message.from_user.id,)
-        )
-        
-        if not expenses:
-            await message.answer(
-                "📭 У вас пока нет записей о расходах.\n"
-                "Выберите другое действие:",
-                reply_markup=main_keyboard
-            )
-            return
-        
-        # Создаем клавиатуру с кнопками для выбора расхода
-        keyboard = []
-        for expense in expenses:
-            expense_id, amount, category, description, date = expense
-            button_text = f"💰 {amount:.2f} руб. | {category} | {description[:20]}..."
-            keyboard.append([InlineKeyboardButton(
-                text=button_text,
-                callback_data=f"delete_{expense_id}"
-            )])
-        
-        # Добавляем кнопку отмены
-        keyboard.append([InlineKeyboardButton(
-            text="❌ Отмена",
-            callback_data="delete_cancel"
-        )])
+    async with router.reader(message.from_user.id) as conn:
+        # Получаем первую страницу расходов
+        expenses, has_next = await history.fetch_page(conn, message.from_user.id, "delete")
         
+    if not expenses:
         await message.answer(
-            "🗑 Выберите расход для удаления:\n\n"
-            "📝 Последние 10 записей:",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+            "📭 У вас пока нет записей о расходах.\n"
+            "Выберите другое действие:",
+            reply_markup=main_keyboard
         )
+        return
+    
+    # Клавиатура с кнопками для выбора расхода, навигацией и отменой
+    response, reply_markup = history.build_page("delete", expenses, 1, False, has_next)
+    await message.answer(response, reply_markup=reply_markup)
 
 @dp.callback_query(F.data.startswith("delete_"))
 async def process_delete_selection(callback: types.CallbackQuery):
@@ -469,40 +611,46 @@ async def process_delete_selection(callback: types.CallbackQuery):
         
         expense_id = int(callback.data.split("_")[1])
         
-        async with aiosqlite.connect("expenses.db") as db:
+        async def remove_expense(conn):
             # Получаем информацию о расходе перед удалением
-            cursor = await db.execute(
-                "SELECT amount, category, description, date FROM expenses WHERE id = ? AND user_id = ?",
+            cursor = await conn.execute(
+                f"SELECT {money.AMOUNT_CENTS}, category, description, date FROM expenses WHERE id = ? AND user_id = ?",
                 (expense_id, callback.from_user.id)
             )
             expense = await cursor.fetchone()
             
-            if not expense:
-                await callback.message.answer(
-                    "❌ Расход не найден.\n"
-                    "Выберите другое действие:",
-                    reply_markup=main_keyboard
+            if expense:
+                # Удаляем расход
+                await rollups.apply_expense(conn, expense_id, callback.from_user.id, -1)
+                await conn.execute(
+                    "DELETE FROM expenses WHERE id = ? AND user_id = ?",
+                    (expense_id, callback.from_user.id)
                 )
-                await callback.answer()
-                return
-            
-            # Удаляем расход
-            await db.execute(
-                "DELETE FROM expenses WHERE id = ? AND user_id = ?",
-                (expense_id, callback.from_user.id)
-            )
-            await db.commit()
-            
-            amount, category, description, date = expense
+                await bump_data_version(conn, callback.from_user.id)
+            return expense
+        
+        expense = await router.submit(callback.from_user.id, remove_expense)
+        response_cache.invalidate_user(callback.from_user.id)
+        
+        if not expense:
             await callback.message.answer(
-                "✅ Расход успешно удален!\n\n"
-                f"💰 Сумма: {amount:.2f} руб.\n"
-                f"📁 Категория: {category}\n"
-                f"📝 Описание: {description}\n"
-                f"📅 Дата: {date}\n\n"
-                "Выберите следующее действие:",
+                "❌ Расход не найден.\n"
+                "Выберите другое действие:",
                 reply_markup=main_keyboard
             )
+            await callback.answer()
+            return
+        
+        amount, category, description, date = expense
+        await callback.message.answer(
+            "✅ Расход успешно удален!\n\n"
+            f"💰 Сумма: {money.format_amount(amount)} руб.\n"
+            f"📁 Категория: {category}\n"
+            f"📝 Описание: {description}\n"
+            f"📅 Дата: {date}\n\n"
+            "Выберите следующее действие:",
+            reply_markup=main_keyboard
+        )
     except ValueError:
         await callback.message.answer(
             "❌ Ошибка: неверный формат ID расхода.\n"
@@ -518,24 +666,187 @@ async def process_delete_selection(callback: types.CallbackQuery):
     finally:
         await callback.answer()
 
-@dp.message(F.text == "📥 Экспорт")
-async def export_data(message: types.Message):
-    # Создаем клавиатуру для выбора формата
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="📊 Excel", callback_data="export_excel"),
-                InlineKeyboardButton(text="📄 PDF", callback_data="export_pdf")
-            ],
-            [
-                InlineKeyboardButton(text="❌ Отмена", callback_data="export_cancel")
-            ]
-        ]
+@dp.callback_query(F.data.startswith(history.PAGE_PREFIX))
+async def process_history_page(callback: types.CallbackQuery):
+    try:
+        mode, direction, page, cursor = history.parse_page_callback(callback.data)
+        async with router.reader(callback.from_user.id) as conn:
+            expenses, has_more = await history.fetch_page(
+                conn, callback.from_user.id, mode, direction, cursor
+            )
+        
+        if not expenses:
+            await callback.answer("📭 Больше записей нет")
+            return
+        
+        # В сторону, откуда пришли, страницы есть всегда
+        if direction == "next":
+            has_prev, has_next = True, has_more
+        else:
+            has_prev, has_next = has_more, True
+        if not has_prev:
+            page = 1
+        
+        response, reply_markup = history.build_page(mode, expenses, page, has_prev, has_next)
+        await callback.message.edit_text(response, reply_markup=reply_markup)
+        await callback.answer()
+    except ValueError:
+        await callback.answer("❌ Неверная страница")
+
+async def search_page(user_id, query, page):
+    """Текст и клавиатура страницы результатов поиска; ранжирование и итоги берутся из кэша."""
+    view = f"search:{query}"
+    cached = response_cache.get(user_id, view)
+    generation = response_cache.generation(user_id)
+    async with router.reader(user_id) as conn:
+        if cached is None:
+            cached = await search.run_search(conn, user_id, query)
+            # В кэше только id лучших совпадений и итоги, страницы собираются заново
+            response_cache.set(user_id, view, cached, generation, size=64 * len(cached[0]) + 200)
+        ids, count, total_cents = cached
+        page = min(max(page, 1), search.page_count(ids))
+        expenses = await search.fetch_page(conn, user_id, ids, page)
+    return search.build_page(query, expenses, page, ids, count, total_cents)
+
+async def answer_search(message, text):
+    try:
+        query = search.normalize(text)
+    except search.SearchQueryError as e:
+        await message.answer(f"❌ Некорректный запрос: {e}")
+        return False
+
+    response, reply_markup = await search_page(message.from_user.id, query, 1)
+    await message.answer(response, reply_markup=reply_markup)
+    return True
+
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext):
+    if not command.args:
+        await search_data(message, state)
+        return
+    await answer_search(message, command.args)
+
+@dp.message(F.text == "🔍 Поиск")
+async def search_data(message: types.Message, state: FSMContext):
+    await message.answer(
+        "🔍 Введите слова из описания расхода, например: такси\n"
+        "Слова ищутся по началу: «продукт» найдет и «продукты».",
+        reply_markup=cancel_keyboard
     )
+    await state.set_state(ExpenseStates.waiting_for_search_query)
+
+@dp.message(ExpenseStates.waiting_for_search_query)
+async def process_search_query(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await message.answer(
+            "❌ Поиск отменен.\n"
+            "Выберите другое действие:",
+            reply_markup=main_keyboard
+        )
+        await state.clear()
+        return
+
+    if not await answer_search(message, message.text):
+        return
+    await state.clear()
+    await message.answer("Выберите следующее действие:", reply_markup=main_keyboard)
+
+@dp.callback_query(F.data.startswith(search.SEARCH_PREFIX))
+async def process_search_page(callback: types.CallbackQuery):
+    try:
+        page, query = search.parse_page_callback(callback.data)
+    except ValueError:
+        # Неверный номер страницы или запрос, не прошедший search.normalize
+        await callback.answer("❌ Неверная страница")
+        return
+
+    response, reply_markup = await search_page(callback.from_user.id, query, page)
+    try:
+        await callback.message.edit_text(response, reply_markup=reply_markup)
+    except TelegramBadRequest:
+        # Страница не изменилась
+        pass
+    await callback.answer()
+
+async def budgets_overview(user_id):
+    month = budgets.current_month()
+    async with router.reader(user_id) as conn:
+        rows = await budgets.fetch_budgets(conn, user_id, month)
+    return budgets.build_overview(rows, month), budgets.categories_keyboard(CATEGORIES)
+
+@dp.message(F.text == "🎯 Бюджеты")
+async def show_budgets(message: types.Message):
+    text, reply_markup = await budgets_overview(message.from_user.id)
+    await message.answer(text, reply_markup=reply_markup)
+
+@dp.callback_query(F.data.startswith(budgets.BUDGET_PREFIX))
+async def process_budget_category(callback: types.CallbackQuery, state: FSMContext):
+    category = callback.data[len(budgets.BUDGET_PREFIX):]
+    if category not in CATEGORIES.values():
+        await callback.answer("❌ Неизвестная категория")
+        return
     
+    await state.update_data(budget_category=category)
+    await callback.message.answer(
+        f"🎯 Введите месячный лимит для категории «{category}» в рублях.\n"
+        "Например: 15000. Чтобы убрать бюджет, введите 0.",
+        reply_markup=cancel_keyboard
+    )
+    await state.set_state(ExpenseStates.waiting_for_budget_limit)
+    await callback.answer()
+
+@dp.message(ExpenseStates.waiting_for_budget_limit)
+async def process_budget_limit(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await message.answer(
+            "❌ Изменение бюджета отменено.\n"
+            "Выберите другое действие:",
+            reply_markup=main_keyboard
+        )
+        await state.clear()
+        return
+    
+    data = await state.get_data()
+    if "budget_category" not in data:
+        await message.answer(
+            "❌ Произошла ошибка. Пожалуйста, выберите категорию заново.",
+            reply_markup=main_keyboard
+        )
+        await state.clear()
+        return
+    
+    try:
+        # 0 удаляет бюджет
+        limit_cents = None if (message.text or "").strip() == "0" else money.parse_amount(message.text)
+    except ValueError:
+        await message.answer("❌ Пожалуйста, введите положительное число или 0")
+        return
+    
+    try:
+        await router.submit(
+            message.from_user.id,
+            lambda conn: budgets.set_budget(conn, message.from_user.id, data["budget_category"], limit_cents)
+        )
+    except Exception as e:
+        await message.answer(f"❌ Произошла ошибка: {str(e)}", reply_markup=main_keyboard)
+        return
+    finally:
+        await state.clear()
+    if limit_cents is None:
+        await message.answer(f"✅ Бюджет «{data['budget_category']}» удален.", reply_markup=main_keyboard)
+    else:
+        await message.answer(
+            f"✅ Бюджет «{data['budget_category']}»: {money.format_amount(limit_cents)} руб. в месяц.",
+            reply_markup=main_keyboard
+        )
+    text, reply_markup = await budgets_overview(message.from_user.id)
+    await message.answer(text, reply_markup=reply_markup)
+
+@dp.message(F.text == "📥 Экспорт")
+async def export_data(message: types.Message):
     await message.answer(
         "📥 Выберите формат для экспорта данных:",
-        reply_markup=keyboard
+        reply_markup=export_keyboard
     )
 
 @dp.callback_query(F.data.startswith("export_"))
@@ -550,22 +861,19 @@ async def process_export_format(callback: types.CallbackQuery):
             await callback.answer()
             return
 
-        # Получаем данные из базы
-        async with aiosqlite.connect("expenses.db") as db:
-            cursor = await db.execute(
-                """SELECT 
-                    strftime('%d.%m.%Y %H:%M', date) as formatted_date,
-                    amount,
-                    COALESCE(category, '-') as category,
-                    COALESCE(description, '-') as description
-                FROM expenses 
-                WHERE user_id = ? 
-                ORDER BY date DESC""",
+        kind = callback.data.split("_")[1]
+        if kind not in REPORT_SUFFIXES:
+            return
+
+        # Дешёвая проверка по индексу, чтобы не запускать отчёт впустую
+        async with router.reader(callback.from_user.id) as conn:
+            has_expenses = await conn.execute_fetchall(
+                "SELECT 1 FROM expenses WHERE user_id = ? LIMIT 1",
                 (callback.from_user.id,)
             )
-            expenses = await cursor.fetchall()
+            version = await get_data_version(conn, callback.from_user.id)
 
-        if not expenses:
+        if not has_expenses:
             await callback.message.answer(
                 "📭 У вас пока нет записей о расходах.\n"
                 "Выберите другое действие:",
@@ -574,159 +882,48 @@ async def process_export_format(callback: types.CallbackQuery):
             await callback.answer()
             return
 
-        if callback.data == "export_excel":
-            # Создаем Excel файл
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Расходы"
-
-            # Устанавливаем заголовки
-            headers = ["Дата", "Сумма", "Категория", "Описание"]
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = Font(bold=True)
-                cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-
-            # Заполняем данные
-            for row, expense in enumerate(expenses, 2):
-                date, amount, category, description = expense
-                ws.cell(row=row, column=1, value=date).alignment = Alignment(horizontal="center")
-                ws.cell(row=row, column=2, value=amount).number_format = '#,##0.00'
-                ws.cell(row=row, column=3, value=category)
-                ws.cell(row=row, column=4, value=description)
-
-            # Настраиваем ширину столбцов
-            for col in range(1, 5):
-                ws.column_dimensions[get_column_letter(col)].width = 20
-
-            # Сохраняем файл в байты
-            excel_file = BytesIO()
-            wb.save(excel_file)
-            excel_file.seek(0)
-
-            # Отправляем файл
-            await callback.message.answer_document(
-                document=types.BufferedInputFile(
-                    file=excel_file.getvalue(),
-                    filename=f"expenses_{callback.from_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                ),
-                caption="📊 Ваши расходы успешно экспортированы в Excel!"
-            )
+        extension, caption = {
+            "excel": ("xlsx", "📊 Ваши расходы успешно экспортированы в Excel!"),
+            "pdf": ("pdf", "📄 Ваши расходы успешно экспортированы в PDF!"),
+        }[kind]
 
-        elif callback.data == "export_pdf":
-            # Создаем PDF файл
-            pdf_file = BytesIO()
-            doc = SimpleDocTemplate(
-                pdf_file,
-                pagesize=letter,
-                rightMargin=30,
-                leftMargin=30,
-                topMargin=30,
-                bottomMargin=30
-            )
-            elements = []
-
-            # Создаем стили
-            styles = getSampleStyleSheet()
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=20,
-                spaceAfter=30,
-                alignment=1
-            )
+        # Если данные не менялись, отправляем уже готовый отчет
+        file_id, report_path = export_cache.get(callback.from_user.id, kind, version, extension)
+        if file_id is not None:
+            await callback.message.answer_document(document=file_id, caption=caption)
+            return
 
-            # Добавляем заголовок
-            elements.append(Paragraph("Отчет о расходах", title_style))
+        if report_path is None:
+            # Отчёт формируется в отдельном процессе, цикл событий не блокируется
+            report_path = await report_service.render(kind, router.path_for(callback.from_user.id), callback.from_user.id)
+            report_path = export_cache.put(callback.from_user.id, kind, version, extension, report_path)
 
-            # Подготавливаем данные для таблицы
-            data = [["Дата", "Сумма", "Категория", "Описание"]]
-            
-            # Добавляем данные в таблицу
-            total_amount = 0
-            for expense in expenses:
-                date, amount, category, description = expense
-                formatted_amount = f"{float(amount):,.2f}"
-                total_amount += float(amount)
-                
-                data.append([
-                    date,
-                    formatted_amount,
-                    category,
-                    description
-                ])
-            
-            # Добавляем строку с общей суммой
-            data.append(["", "", "ИТОГО:", f"{total_amount:,.2f}"])
-
-            # Создаем таблицу с нужной шириной колонок
-            col_widths = [100, 80, 100, 250]
-            table = Table(data, colWidths=col_widths)
-            
-            # Настраиваем стиль таблицы
-            table_style = [
-                # Заголовок таблицы
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#333333')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('TOPPADDING', (0, 0), (-1, 0), 12),
-                
-                # Основное содержимое
-                ('ALIGN', (0, 1), (0, -2), 'CENTER'),  # Дата по центру
-                ('ALIGN', (1, 1), (1, -1), 'RIGHT'),   # Сумма справа
-                ('ALIGN', (2, 1), (2, -2), 'CENTER'),  # Категория по центру
-                ('ALIGN', (3, 1), (3, -2), 'LEFT'),    # Описание слева
-                
-                # Итоговая строка
-                ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#f5f5f5')),
-                ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-                ('ALIGN', (2, -1), (3, -1), 'RIGHT'),
-                
-                # Границы и отступы
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('BOX', (0, 0), (-1, -1), 2, colors.black),
-                ('LEFTPADDING', (0, 0), (-1, -1), 6),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-                
-                # Шрифты для содержимого
-                ('FONTSIZE', (0, 1), (-1, -2), 10),
-                ('FONTNAME', (0, 1), (-1, -2), 'Helvetica'),
-            ]
-            
-            table.setStyle(TableStyle(table_style))
-            
-            elements.append(table)
-            
-            # Добавляем дату создания отчета
-            date_style = ParagraphStyle(
-                'DateStyle',
-                parent=styles['Normal'],
-                fontSize=8,
-                textColor=colors.gray,
-                alignment=2,  # Справа
-                spaceAfter=0,
-                spaceBefore=20,
-            )
-            current_date = datetime.now().strftime("%d.%m.%Y %H:%M")
-            elements.append(Paragraph(f"Отчет создан: {current_date}", date_style))
-
-            # Создаем документ
-            doc.build(elements)
-
-            # Отправляем файл
-            pdf_file.seek(0)
-            await callback.message.answer_document(
-                document=types.BufferedInputFile(
-                    file=pdf_file.getvalue(),
-                    filename=f"expenses_{callback.from_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        # Файл отправляется с диска порциями, без копирования в память
+        try:
+            sent = await callback.message.answer_document(
+                document=types.FSInputFile(
+                    report_path,
+                    filename=f"expenses_{callback.from_user.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
                 ),
-                caption="📄 Ваши расходы успешно экспортированы в PDF!"
+                caption=caption
             )
+            if sent.document is not None:
+                export_cache.remember_file_id(callback.from_user.id, kind, version, sent.document.file_id)
+        finally:
+            # Файлы, не попавшие в кэш (слишком большие), сразу удаляем
+            if not export_cache.contains(report_path):
+                os.remove(report_path)
 
+    except ReportQueueFull:
+        await callback.message.answer(
+            "⏳ Сейчас формируется слишком много отчетов.\n"
+            "Пожалуйста, попробуйте через пару минут."
+        )
+    except ReportTimeout:
+        await callback.message.answer(
+            "⏳ Отчет формировался слишком долго и был отменен.\n"
+            "Пожалуйста, попробуйте позже."
+        )
     except Exception as e:
         await callback.message.answer(
             f"❌ Произошла ошибка при экспорте данных: {str(e)}\n"
@@ -735,24 +932,247 @@ async def process_export_format(callback: types.CallbackQuery):
     finally:
         await callback.answer()
 
-async def main():
-    # Подключение к базе данных
-    async with aiosqlite.connect("expenses.db") as db:
-        # Создание таблицы расходов
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS expenses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL,
-                category TEXT,
-                description TEXT,
-                date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+@dp.message(F.text == "📤 Импорт")
+async def import_data(message: types.Message, state: FSMContext):
+    await message.answer(
+        "📤 Отправьте файл CSV или Excel (.xlsx) с расходами.\n\n"
+        "Колонки: Дата, Сумма, Категория, Описание - как в экспорте.\n"
+        "Строка заголовка необязательна, дата в формате 31.12.2024 или 2024-12-31, "
+        "без даты расход записывается сегодняшним днем. "
+        "Незнакомые категории попадут в «Другое».",
+        reply_markup=cancel_keyboard
+    )
+    await state.set_state(ExpenseStates.waiting_for_import_file)
+
+@dp.message(ExpenseStates.waiting_for_import_file, F.document)
+async def process_import_file(message: types.Message, state: FSMContext):
+    document = message.document
+    name = document.file_name or ""
+    suffix = os.path.splitext(name)[1].lower()
+    if suffix not in importer.IMPORT_SUFFIXES:
+        await message.answer("❌ Поддерживаются только файлы .csv и .xlsx")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer(
+            f"❌ Файл слишком большой, максимум {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ"
+        )
+        return
+
+    await state.clear()
+    progress = await message.answer("⏳ Загружаю файл...", reply_markup=main_keyboard)
+    last_edit = time.monotonic()
+
+    async def show_progress(read):
+        # Сообщение о прогрессе правится не чаще раза в IMPORT_PROGRESS_INTERVAL секунд
+        nonlocal last_edit
+        if time.monotonic() - last_edit < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        await progress.edit_text(f"⏳ Прочитано строк: {read}")
+
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=suffix)
+    os.close(fd)
+    started = time.perf_counter()
+    try:
+        async with import_semaphore:
+            await bot.download(document, destination=path, timeout=120)
+            parsed = await importer.read_expenses(
+                path,
+                CATEGORIES,
+                CATEGORIES["💡 Другое"],
+                IMPORT_MAX_ROWS,
+                chunk_size=IMPORT_BATCH_SIZE,
+                on_progress=show_progress
+            )
+            if parsed.rows:
+                await progress.edit_text(f"⏳ Записываю {len(parsed.rows)} расходов...")
+                # Все строки файла фиксируются одной транзакцией: импорт либо целиком, либо никак
+                await router.submit(
+                    message.from_user.id,
+                    lambda conn: importer.insert_expenses(conn, message.from_user.id, parsed.rows, IMPORT_BATCH_SIZE)
+                )
+                response_cache.invalidate_user(message.from_user.id)
+        metrics.IMPORT_LATENCY.observe(time.perf_counter() - started, suffix[1:])
+        metrics.IMPORT_ROWS.inc("imported", amount=len(parsed.rows))
+        metrics.IMPORT_ROWS.inc("skipped", amount=parsed.skipped)
+
+        response = (
+            "✅ Импорт завершен!\n\n"
+            f"📥 Добавлено расходов: {len(parsed.rows)}\n"
+        )
+        if parsed.recategorized:
+            response += f"💡 С незнакомой категорией (записаны в «Другое»): {parsed.recategorized}\n"
+        if parsed.skipped:
+            response += f"⚠️ Пропущено строк с ошибками: {parsed.skipped}\n"
+            response += "".join(f"• {error}\n" for error in parsed.errors)
+        await progress.edit_text(response)
+    except importer.ImportFormatError as e:
+        await progress.edit_text(f"❌ Не удалось прочитать файл: {e}")
+    except importer.ImportTooLarge:
+        await progress.edit_text(
+            f"❌ В файле больше {IMPORT_MAX_ROWS} строк. Разбейте его на части и загрузите по очереди."
+        )
+    except Exception as e:
+        logging.exception("Ошибка импорта для пользователя %s", message.from_user.id)
+        await progress.edit_text(f"❌ Произошла ошибка при импорте: {str(e)}")
+    finally:
+        os.remove(path)
+
+@dp.message(ExpenseStates.waiting_for_import_file)
+async def process_import_text(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await message.answer(
+            "❌ Импорт отменен.\n"
+            "Выберите другое действие:",
+            reply_markup=main_keyboard
+        )
+        await state.clear()
+        return
+
+    await message.answer("📎 Пожалуйста, отправьте файл .csv или .xlsx документом.")
+
+# Фоновые задачи, которые останавливаются вместе со службами
+background_tasks = []
+
+async def migrate_amounts():
+    # Старые суммы переводятся в копейки небольшими транзакциями, бот работает как обычно
+    try:
+        for db, queue in zip(router.databases, router.write_queues):
+            await money.migrate_amounts(
+                db, queue,
+                batch_size=AMOUNT_MIGRATION_BATCH,
+                pause=AMOUNT_MIGRATION_PAUSE_MS / 1000
             )
-        """)
-        await db.commit()
+    except Exception:
+        logging.exception("Не удалось перевести суммы в копейки")
 
-    # Запуск бота
-    await dp.start_polling(bot)
+async def start_services(metrics_port=METRICS_PORT, migrate=True):
+    # Открываем шарды базы данных (схема обновляется при открытии) и фоновые службы
+    await router.open()
+    router.start()
+    if migrate:
+        background_tasks.append(asyncio.create_task(migrate_amounts()))
+    report_service.start()
+    export_cache.open()
+    storage.start()
+    if REPORT_PREWARM:
+        # Процессы отчётов поднимаются в фоне, чтобы первый экспорт не ждал их запуска
+        report_service.warm_up()
+    startup["seconds"] = round(time.perf_counter() - STARTED_AT, 3)
+    logging.info("Бот готов к работе за %.2f с", startup["seconds"])
+    if metrics_port:
+        return await metrics.start_metrics_server(METRICS_HOST, metrics_port)
+    return None
+
+async def stop_services(metrics_runner=None):
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    # Прерванный перенос сумм продолжится при следующем запуске
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    logging.info("Кэш ответов: %s", response_cache.stats())
+    logging.info("Отчеты: %s", report_service.stats())
+    logging.info("Кэш экспорта: %s", export_cache.stats())
+    logging.info("Отправка сообщений: %s", send_scheduler.stats())
+    logging.info("Ограничение запросов: %s", throttling.stats())
+    logging.info("Обслуживание базы: %s", router.maintenance_stats())
+    report_service.shutdown()
+    await storage.close()
+    await router.stop()
+    await router.close()
+
+async def worker_main(index, queue, heartbeat):
+    # У каждого рабочего процесса свой каталог кэша экспорта: пользователь всегда
+    # обслуживается одним процессом, а чужое вытеснение не удаляет файлы из-под ног
+    export_cache.directory = os.path.join(EXPORT_CACHE_DIR, f"worker_{index}")
+    export_cache.max_bytes = EXPORT_CACHE_MAX_BYTES // WORKER_PROCESSES
+    # Суммы переносит только первый рабочий процесс, чтобы не делать одну работу дважды
+    metrics_runner = await start_services(METRICS_PORT + 1 + index if METRICS_PORT else 0, migrate=index == 0)
+    try:
+        await consume_updates(dp, bot, queue, heartbeat)
+    finally:
+        await stop_services(metrics_runner)
+        await bot.session.close()
+
+def run_worker(index, queue, heartbeat):
+    # Точка входа рабочего процесса в многопроцессном режиме
+    logging.info("Рабочий процесс %d готов", index)
+    asyncio.run(worker_main(index, queue, heartbeat))
+
+async def run_supervisor():
+    # Схема и распределение по шардам обновляются один раз, до запуска рабочих процессов
+    await router.open()
+    await router.rebalance()
+    await router.close()
+
+    supervisor = Supervisor(
+        run_worker,
+        WORKER_PROCESSES,
+        health_interval=WORKER_HEALTH_INTERVAL,
+        health_timeout=WORKER_HEALTH_TIMEOUT
+    )
+    supervisor.start()
+    monitor = asyncio.create_task(supervisor.monitor())
+    metrics.register_stats("bot_workers", supervisor.stats)
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                url=WEBHOOK_URL,
+                forward=supervisor.route
+            )
+        else:
+            await bot.delete_webhook()
+            await poll_updates(bot, supervisor, dp.resolve_used_update_types())
+    finally:
+        monitor.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        logging.info("Рабочие процессы: %s", supervisor.stats())
+        supervisor.stop()
+        await bot.session.close()
+
+async def main():
+    # Несколько рабочих процессов с распределением пользователей по ним
+    if WORKER_PROCESSES > 1:
+        await run_supervisor()
+        return
+
+    metrics_runner = await start_services()
+    # Число шардов изменилось: данные переносятся в фоне, бот продолжает работать
+    rebalance = None
+    if router.needs_rebalance():
+        rebalance = asyncio.create_task(router.rebalance())
+
+    # Запуск бота: long polling или вебхук
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                url=WEBHOOK_URL,
+                max_concurrent=WEBHOOK_MAX_CONCURRENT
+            )
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if rebalance is not None:
+            # Текущий бакет дописывается, остальные перенесутся при следующем запуске
+            router.interrupt()
+            await rebalance
+        await stop_services(metrics_runner)
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
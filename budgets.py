@@ -0,0 +1,154 @@
+from datetime import date
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from money import format_amount
+
+# Месячные бюджеты по категориям. Потраченное за месяц - это месячный итог
+# категории в period_totals, который обновляется в той же транзакции, что и
+# запись расхода. rollups.apply_expense возвращает его значения до и после
+# изменения, поэтому пересечение порога определяется сравнением двух чисел
+# и одним поиском лимита по первичному ключу, без агрегирующих запросов.
+#
+# Кнопки выбора категории: callback_data «budget_set_<категория>».
+
+BUDGET_PREFIX = "budget_set_"
+
+# Пороги предупреждений в процентах от лимита
+THRESHOLDS = (80, 100)
+
+MONTH_NAMES = (
+    "январе", "феврале", "марте", "апреле", "мае", "июне",
+    "июле", "августе", "сентябре", "октябре", "ноябре", "декабре",
+)
+
+
+def crossed_threshold(limit_cents, before, after):
+    """Наибольший порог, пересечённый при росте итога с before до after, или None."""
+    for threshold in reversed(THRESHOLDS):
+        # Сравнение в целых числах: before < limit * threshold% <= after
+        if before * 100 < limit_cents * threshold <= after * 100:
+            return threshold
+    return None
+
+
+def edit_change(removed, added):
+    """Изменение месячного итога категории, куда попала запись после правки.
+
+    removed и added - результаты rollups.apply_expense до и после изменения записи.
+    """
+    if added is None:
+        return None
+    category, month, before, after = added
+    if removed is not None and removed[:2] == (category, month):
+        # Та же категория и месяц: до правки итог был до вычитания старого значения
+        before = removed[2]
+    return category, month, before, after
+
+
+async def check_change(conn, user_id, change):
+    """Текст предупреждения, если изменение итога пересекло порог бюджета, иначе None."""
+    if change is None:
+        return None
+    category, month, before, after = change
+    if after <= before:
+        return None
+    rows = await conn.execute_fetchall(
+        "SELECT limit_cents FROM budgets WHERE user_id = ? AND category = ?",
+        (user_id, category)
+    )
+    if not rows:
+        return None
+    limit_cents = rows[0][0]
+    threshold = crossed_threshold(limit_cents, before, after)
+    if threshold is None:
+        return None
+    return alert_text(category, date.fromisoformat(month), limit_cents, after, threshold)
+
+
+def alert_text(category, month, limit_cents, spent_cents, threshold):
+    period = f"в {MONTH_NAMES[month.month - 1]} {month.year}"
+    if threshold >= 100 and spent_cents == limit_cents:
+        return f"🚨 Бюджет «{category}» {period} израсходован полностью: {format_amount(limit_cents)} руб."
+    if threshold >= 100:
+        return (
+            f"🚨 Бюджет «{category}» {period} превышен: "
+            f"{format_amount(spent_cents)} из {format_amount(limit_cents)} руб. "
+            f"(+{format_amount(spent_cents - limit_cents)} руб.)"
+        )
+    return (
+        f"⚠️ Бюджет «{category}» {period} израсходован на {threshold}%: "
+        f"{format_amount(spent_cents)} из {format_amount(limit_cents)} руб., "
+        f"осталось {format_amount(limit_cents - spent_cents)} руб."
+    )
+
+
+def current_month():
+    return date.today().replace(day=1)
+
+
+async def fetch_budgets(conn, user_id, month):
+    """Бюджеты пользователя с потраченным за месяц: [(категория, лимит, потрачено)]."""
+    return await conn.execute_fetchall(
+        """
+        SELECT budgets.category, budgets.limit_cents, COALESCE(period_totals.sum_cents, 0)
+        FROM budgets
+        LEFT JOIN period_totals ON period_totals.user_id = budgets.user_id
+            AND period_totals.grain = 'month'
+            AND period_totals.period = ?
+            AND period_totals.category = budgets.category
+        WHERE budgets.user_id = ?
+        ORDER BY budgets.category
+        """,
+        (month.isoformat(), user_id)
+    )
+
+
+async def set_budget(conn, user_id, category, limit_cents):
+    """Задаёт лимит категории; limit_cents=None удаляет бюджет."""
+    if limit_cents is None:
+        await conn.execute(
+            "DELETE FROM budgets WHERE user_id = ? AND category = ?",
+            (user_id, category)
+        )
+        return
+    await conn.execute(
+        """
+        INSERT INTO budgets (user_id, category, limit_cents) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, category) DO UPDATE SET limit_cents = excluded.limit_cents
+        """,
+        (user_id, category, limit_cents)
+    )
+
+
+def build_overview(budgets, month):
+    """Текст со списком бюджетов за месяц."""
+    if not budgets:
+        return (
+            "🎯 Бюджеты не заданы.\n\n"
+            "Выберите категорию, чтобы задать месячный лимит. "
+            f"Я предупрежу, когда расходы дойдут до {THRESHOLDS[0]}% и превысят лимит."
+        )
+    response = f"🎯 Бюджеты в {MONTH_NAMES[month.month - 1]} {month.year}:\n\n"
+    for category, limit_cents, spent_cents in budgets:
+        percentage = spent_cents * 100 / limit_cents
+        mark = "🚨" if percentage >= 100 else "⚠️" if percentage >= THRESHOLDS[0] else "✅"
+        response += (
+            f"{mark} {category}: {format_amount(spent_cents)} из {format_amount(limit_cents)} руб. "
+            f"({percentage:.0f}%)\n"
+        )
+    response += "\nВыберите категорию, чтобы изменить лимит."
+    return response
+
+
+def categories_keyboard(categories):
+    keyboard = []
+    row = []
+    for label, category in categories.items():
+        row.append(InlineKeyboardButton(text=label, callback_data=f"{BUDGET_PREFIX}{category}"))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
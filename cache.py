@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """LRU-кэш готовых ответов по ключу (user_id, view) с TTL и лимитом памяти."""
+
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._generations = {}
+        self._bytes = 0
+
+    def generation(self, user_id):
+        # Снимок поколения берётся до чтения из БД: если за время чтения
+        # пользователь что-то записал, устаревший ответ не попадёт в кэш
+        return self._generations.get(user_id, 0)
+
+    def get(self, user_id, view):
+        key = (user_id, view)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, size, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, user_id, view, value, generation, size=None):
+        # size задаётся явно для значений, которые не являются парой (текст, клавиатура)
+        if generation != self.generation(user_id):
+            return
+        key = (user_id, view)
+        if key in self._entries:
+            self._remove(key)
+        if size is None:
+            size = self._estimate_size(value)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self._user_keys.setdefault(user_id, set()).add(view)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        for view in self._user_keys.pop(user_id, ()):
+            entry = self._entries.pop((user_id, view), None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _remove(self, key):
+        value, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        views = self._user_keys.get(key[0])
+        if views is not None:
+            views.discard(key[1])
+            if not views:
+                del self._user_keys[key[0]]
+
+    @staticmethod
+    def _estimate_size(value):
+        # Основной объём ответа - текст; клавиатуры небольшие и оцениваются грубо
+        text, reply_markup = value
+        size = len(text.encode("utf-8")) + 200
+        if reply_markup is not None:
+            size += 200 * sum(len(row) for row in getattr(reply_markup, "inline_keyboard", []))
+        return size
@@ -1,5 +1,108 @@
+import os
+from dotenv import load_dotenv
 from aiogram.fsm.state import State, StatesGroup
 
+# Загрузка переменных окружения
+load_dotenv()
+
+# Адрес Bot API (пусто - api.telegram.org), например локального Bot API сервера
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# База данных
+DB_PATH = os.getenv("DB_PATH", "expenses.db")
+# Количество соединений только для чтения в пуле
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Число шардов: пользователи распределяются по файлам DB_PATH, expenses_1.db, ...
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+# Профиль SQLite для каждого соединения: режим журнала, synchronous (NORMAL безопасен в WAL
+# и не синхронизирует диск на каждой фиксации), отображение файла в память, кэш страниц
+# на соединение в КБ и ожидание блокировки в мс
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(16 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# WAL: до какого размера усекать файл журнала, автоматическая контрольная точка
+# при фиксации (в страницах, страховка на случай, если фоновая не успевает)
+DB_JOURNAL_SIZE_LIMIT = int(os.getenv("DB_JOURNAL_SIZE_LIMIT", str(64 * 1024 * 1024)))
+DB_WAL_AUTOCHECKPOINT = int(os.getenv("DB_WAL_AUTOCHECKPOINT", "10000"))
+# Фоновое обслуживание: период контрольных точек WAL (с), их режим
+# (PASSIVE, FULL, RESTART, TRUNCATE) и период PRAGMA optimize (с); 0 - отключено
+DB_CHECKPOINT_INTERVAL = int(os.getenv("DB_CHECKPOINT_INTERVAL", "60"))
+DB_CHECKPOINT_MODE = os.getenv("DB_CHECKPOINT_MODE", "PASSIVE")
+DB_OPTIMIZE_INTERVAL = int(os.getenv("DB_OPTIMIZE_INTERVAL", "3600"))
+# Фоновый перевод старых сумм в копейки: строк за транзакцию и пауза между ними, мс
+AMOUNT_MIGRATION_BATCH = int(os.getenv("AMOUNT_MIGRATION_BATCH", "5000"))
+AMOUNT_MIGRATION_PAUSE_MS = int(os.getenv("AMOUNT_MIGRATION_PAUSE_MS", "10"))
+# Групповая фиксация записи: не больше N операций или M миллисекунд ожидания
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_BATCH_DELAY_MS = int(os.getenv("WRITE_BATCH_DELAY_MS", "10"))
+
+# Кэш ответов статистики и истории
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+
+# Формирование отчетов в пуле процессов
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+REPORT_MAX_CONCURRENT = int(os.getenv("REPORT_MAX_CONCURRENT", os.getenv("REPORT_WORKERS", "2")))
+REPORT_MAX_QUEUE = int(os.getenv("REPORT_MAX_QUEUE", "20"))
+REPORT_TIMEOUT = int(os.getenv("REPORT_TIMEOUT", "120"))
+# Запускать процессы отчётов сразу после старта, а не при первом экспорте (1 - да)
+REPORT_PREWARM = os.getenv("REPORT_PREWARM", "0") == "1"
+
+# Импорт расходов из CSV/XLSX: предел размера файла (Bot API отдаёт боту до 20 МБ)
+# и числа строк, размер пакета вставки, одновременных импортов и период обновления прогресса
+IMPORT_MAX_FILE_SIZE = int(os.getenv("IMPORT_MAX_FILE_SIZE", str(20 * 1024 * 1024)))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "200000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+IMPORT_MAX_CONCURRENT = int(os.getenv("IMPORT_MAX_CONCURRENT", "2"))
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "2"))
+
+# Дисковый кэш готовых отчетов
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "export_cache")
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Хранилище состояний FSM: размер кэша в памяти и время жизни брошенного диалога
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 60 * 60)))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес бота; если не задан, вебхук в Telegram не регистрируется
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько обновлений обрабатывается одновременно
+WEBHOOK_MAX_CONCURRENT = int(os.getenv("WEBHOOK_MAX_CONCURRENT", "100"))
+
+# Многопроцессный режим: число рабочих процессов (1 - обычный режим в одном процессе)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+# Проверка здоровья рабочих процессов: период и допустимая задержка сердцебиения, в секундах
+WORKER_HEALTH_INTERVAL = int(os.getenv("WORKER_HEALTH_INTERVAL", "5"))
+WORKER_HEALTH_TIMEOUT = int(os.getenv("WORKER_HEALTH_TIMEOUT", "30"))
+
+# Лимиты исходящих сообщений: всего в секунду, в один чат в секунду (с запасом на всплеск),
+# в групповой чат в минуту, и число повторов при flood control и сетевых сбоях
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE_PER_MIN = float(os.getenv("SEND_GROUP_RATE_PER_MIN", "20"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+
+# Входящие обновления: лимит на пользователя (в секунду, с запасом на всплеск)
+# и окно, в котором повторное нажатие той же кнопки игнорируется, в секундах
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+CALLBACK_DEDUP_WINDOW = float(os.getenv("CALLBACK_DEDUP_WINDOW", "1"))
+
+# Эндпоинт метрик /metrics (0 - отключён). В многопроцессном режиме
+# рабочий процесс N слушает METRICS_PORT + 1 + N
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
 # Категории расходов
 CATEGORIES = {
     "🍔 Еда": "food",
@@ -22,4 +125,8 @@ class ExpenseStates(StatesGroup):
     waiting_for_edit_field = State()
     waiting_for_edit_value = State()
     waiting_for_edit_id = State()
-    waiting_for_delete_id = State() 
\ No newline at end of file
+    waiting_for_delete_id = State()
+    waiting_for_import_file = State()
+    waiting_for_stats_period = State()
+    waiting_for_search_query = State()
+    waiting_for_budget_limit = State()
\ No newline at end of file
@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from metrics import DB_MAINTENANCE_LATENCY, DB_WAL_BYTES, DB_WAL_FRAMES, observe_sql
+
+JOURNAL_MODES = ("WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF")
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+
+class StorageProfile:
+    """Настройки SQLite для каждого соединения и расписание фонового обслуживания.
+
+    WAL позволяет читателям не ждать писателя, а synchronous=NORMAL в режиме WAL
+    не синхронизирует диск на каждой фиксации (при сбое питания могут потеряться
+    последние транзакции, но не целостность базы). Контрольные точки WAL делает
+    фоновая задача, а не фиксация очередного пакета записи.
+    """
+
+    def __init__(self, journal_mode="WAL", synchronous="NORMAL", mmap_size=256 * 1024 * 1024,
+                 cache_size_kb=16 * 1024, busy_timeout_ms=5000, journal_size_limit=64 * 1024 * 1024,
+                 wal_autocheckpoint=10000, checkpoint_interval=60, checkpoint_mode="PASSIVE",
+                 optimize_interval=3600):
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous.upper()
+        self.checkpoint_mode = checkpoint_mode.upper()
+        if self.journal_mode not in JOURNAL_MODES:
+            raise ValueError(f"Неизвестный режим журнала: {journal_mode}")
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Неизвестный режим synchronous: {synchronous}")
+        if self.checkpoint_mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Неизвестный режим контрольной точки: {checkpoint_mode}")
+        self.mmap_size = int(mmap_size)
+        self.cache_size_kb = int(cache_size_kb)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.journal_size_limit = int(journal_size_limit)
+        self.wal_autocheckpoint = int(wal_autocheckpoint)
+        self.checkpoint_interval = checkpoint_interval
+        self.optimize_interval = optimize_interval
+
+    @classmethod
+    def from_config(cls):
+        from config import (
+            DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_MMAP_SIZE, DB_CACHE_SIZE_KB, DB_BUSY_TIMEOUT_MS,
+            DB_JOURNAL_SIZE_LIMIT, DB_WAL_AUTOCHECKPOINT, DB_CHECKPOINT_INTERVAL, DB_CHECKPOINT_MODE,
+            DB_OPTIMIZE_INTERVAL
+        )
+        return cls(
+            journal_mode=DB_JOURNAL_MODE,
+            synchronous=DB_SYNCHRONOUS,
+            mmap_size=DB_MMAP_SIZE,
+            cache_size_kb=DB_CACHE_SIZE_KB,
+            busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+            journal_size_limit=DB_JOURNAL_SIZE_LIMIT,
+            wal_autocheckpoint=DB_WAL_AUTOCHECKPOINT,
+            checkpoint_interval=DB_CHECKPOINT_INTERVAL,
+            checkpoint_mode=DB_CHECKPOINT_MODE,
+            optimize_interval=DB_OPTIMIZE_INTERVAL
+        )
+
+    def pragmas(self):
+        """Настройки, применяемые один раз при открытии каждого соединения."""
+        return (
+            f"PRAGMA busy_timeout = {self.busy_timeout_ms}",
+            "PRAGMA foreign_keys = ON",
+            f"PRAGMA synchronous = {self.synchronous}",
+            f"PRAGMA mmap_size = {self.mmap_size}",
+            # Отрицательное значение - размер кэша в килобайтах, а не в страницах
+            f"PRAGMA cache_size = {-self.cache_size_kb}",
+        )
+
+    def database_pragmas(self):
+        """Настройки самого файла базы: ставятся через соединение-писатель."""
+        return (
+            f"PRAGMA journal_mode = {self.journal_mode}",
+            f"PRAGMA journal_size_limit = {self.journal_size_limit}",
+            f"PRAGMA wal_autocheckpoint = {self.wal_autocheckpoint}",
+        )
+
+
+class TimedConnection:
+    """Обёртка над соединением aiosqlite, замеряющая время каждого SQL-запроса."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def execute(self, sql, parameters=None):
+        started = time.perf_counter()
+        try:
+            return await self._conn.execute(sql, parameters)
+        finally:
+            observe_sql(sql, started)
+
+    async def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return await self._conn.executemany(sql, parameters)
+        finally:
+            observe_sql(sql, started)
+
+    async def execute_fetchall(self, sql, parameters=None):
+        started = time.perf_counter()
+        try:
+            return await self._conn.execute_fetchall(sql, parameters)
+        finally:
+            observe_sql(sql, started)
+
+
+class Database:
+    """Пул долгоживущих соединений: одно на запись и несколько на чтение."""
+
+    def __init__(self, path, readers=4, profile=None):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.profile = profile or StorageProfile()
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path)
+        for pragma in self.profile.pragmas():
+            await conn.execute(pragma)
+        return TimedConnection(conn)
+
+    async def open(self):
+        if self._writer is not None:
+            return
+        self._writer = await self._connect()
+        # Режим журнала хранится в файле базы, поэтому его достаточно задать до открытия читателей
+        for pragma in self.profile.database_pragmas():
+            await self._writer.execute(pragma)
+        rows = await self._writer.execute_fetchall("PRAGMA journal_mode")
+        if rows[0][0].upper() != self.profile.journal_mode:
+            logging.warning("База %s работает в режиме журнала %s вместо %s", self.path, rows[0][0], self.profile.journal_mode)
+        self._readers = asyncio.Queue(maxsize=self.readers_count)
+        for _ in range(self.readers_count):
+            conn = await self._connect()
+            # Соединения на чтение не могут изменить данные, даже по ошибке в запросе
+            await conn.execute("PRAGMA query_only = ON")
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        logging.info("Открыт пул БД %s: 1 writer, %d readers", self.path, self.readers_count)
+
+    async def close(self):
+        # Перед закрытием соединения SQLite обновляет статистику планировщика по его запросам
+        for conn in self._all_readers:
+            # PRAGMA optimize может запустить ANALYZE, а он пишет статистику в базу
+            await conn.execute("PRAGMA query_only = OFF")
+            await _optimize(conn)
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+        if self._writer is not None:
+            async with self._write_lock:
+                await _optimize(self._writer)
+                await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        # Берём соединение из пула и обязательно возвращаем его обратно
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        # Единственное соединение на запись: транзакции не перемешиваются
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+
+async def _optimize(conn):
+    try:
+        await conn.execute("PRAGMA optimize")
+    except Exception:
+        logging.exception("Не удалось выполнить PRAGMA optimize")
+
+
+class Maintenance:
+    """Фоновое обслуживание базы: контрольные точки WAL и PRAGMA optimize по расписанию."""
+
+    def __init__(self, db):
+        self.db = db
+        self.label = os.path.basename(db.path)
+        self._task = None
+        self.checkpoints = 0
+        self.busy_checkpoints = 0
+        self.optimizations = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(self.db.path + "-wal")
+        except FileNotFoundError:
+            return 0
+
+    async def checkpoint(self):
+        """Переносит WAL в базу; возвращает (занято, кадров в журнале, перенесено кадров)."""
+        DB_WAL_BYTES.set(self.wal_size(), self.label)
+        started = time.perf_counter()
+        # PASSIVE не ждёт ни писателя, ни читателей, поэтому идёт через соединение
+        # на чтение; остальные режимы берут блокировку записи и ждут её в очереди
+        if self.db.profile.checkpoint_mode == "PASSIVE":
+            async with self.db.reader() as conn:
+                rows = await conn.execute_fetchall("PRAGMA wal_checkpoint(PASSIVE)")
+        else:
+            async with self.db.writer() as conn:
+                rows = await conn.execute_fetchall(f"PRAGMA wal_checkpoint({self.db.profile.checkpoint_mode})")
+        DB_MAINTENANCE_LATENCY.observe(time.perf_counter() - started, self.label, "checkpoint")
+        busy, log_frames, checkpointed = rows[0]
+        self.checkpoints += 1
+        if busy:
+            self.busy_checkpoints += 1
+        DB_WAL_FRAMES.set(max(0, log_frames - checkpointed), self.label)
+        DB_WAL_BYTES.set(self.wal_size(), self.label)
+        return busy, log_frames, checkpointed
+
+    async def optimize(self):
+        started = time.perf_counter()
+        async with self.db.writer() as conn:
+            await conn.execute("PRAGMA optimize")
+        DB_MAINTENANCE_LATENCY.observe(time.perf_counter() - started, self.label, "optimize")
+        self.optimizations += 1
+
+    def _schedule(self):
+        profile = self.db.profile
+        schedule = []
+        if profile.journal_mode == "WAL" and profile.checkpoint_interval > 0:
+            schedule.append((profile.checkpoint_interval, self.checkpoint))
+        if profile.optimize_interval > 0:
+            schedule.append((profile.optimize_interval, self.optimize))
+        return schedule
+
+    async def _run(self):
+        schedule = self._schedule()
+        if not schedule:
+            return
+        loop = asyncio.get_running_loop()
+        due = [loop.time() + interval for interval, _ in schedule]
+        while True:
+            await asyncio.sleep(max(0, min(due) - loop.time()))
+            for index, (interval, action) in enumerate(schedule):
+                if loop.time() < due[index]:
+                    continue
+                due[index] = loop.time() + interval
+                try:
+                    await action()
+                except Exception:
+                    logging.exception("Ошибка обслуживания базы %s", self.db.path)
+
+    def stats(self):
+        return {
+            "wal_bytes": self.wal_size(),
+            "checkpoints": self.checkpoints,
+            "busy_checkpoints": self.busy_checkpoints,
+            "optimizations": self.optimizations,
+        }
+
+
+class WriteQueue:
+    """Очередь записи: копит операции и фиксирует их одной транзакцией."""
+
+    def __init__(self, db, max_batch=100, max_delay=0.01):
+        self.db = db
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Дожидаемся записи всего, что уже поставлено в очередь
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, operation):
+        # operation - корутинная функция от соединения; результат возвращается
+        # только после фиксации транзакции, в которую попала операция
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, future))
+        return await future
+
+    async def _collect(self, first):
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch, stopping = await self._collect(first)
+            await self._flush(batch)
+        # Остаток очереди после сигнала остановки
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                rest.append(item)
+        if rest:
+            await self._flush(rest)
+
+    async def _flush(self, batch):
+        results = []
+        try:
+            async with self.db.writer() as conn:
+                await conn.execute("BEGIN")
+                for operation, _ in batch:
+                    # Точка сохранения изолирует ошибку одной операции от остальных
+                    await conn.execute("SAVEPOINT write_op")
+                    try:
+                        result = await operation(conn)
+                    except Exception as e:
+                        await conn.execute("ROLLBACK TO write_op")
+                        await conn.execute("RELEASE write_op")
+                        results.append((None, e))
+                    else:
+                        await conn.execute("RELEASE write_op")
+                        results.append((result, None))
+        except Exception as e:
+            logging.exception("Не удалось зафиксировать пакет из %d операций", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), (result, error) in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+async def bump_data_version(conn, user_id):
+    # Версия данных пользователя растёт при каждой записи в той же транзакции
+    await conn.execute(
+        """
+        INSERT INTO user_data_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+        """,
+        (user_id,)
+    )
+
+
+async def get_data_version(conn, user_id):
+    rows = await conn.execute_fetchall(
+        "SELECT version FROM user_data_versions WHERE user_id = ?",
+        (user_id,)
+    )
+    return rows[0][0] if rows else 0
@@ -0,0 +1,120 @@
+import logging
+import os
+
+
+class ExportCache:
+    """Дисковый кэш готовых отчётов по ключу (user_id, формат, версия данных).
+
+    Версия данных пользователя растёт при каждой записи, поэтому устаревший
+    отчёт просто перестаёт находиться по ключу и со временем вытесняется.
+    Для уже отправленных файлов запоминается file_id Telegram: повторная
+    отправка тогда не требует даже загрузки файла.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._file_ids = {}
+        self._sizes = {}
+        self._bytes = 0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Файлы, оставшиеся с прошлого запуска, тоже можно переиспользовать
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                size = os.path.getsize(path)
+                self._sizes[path] = size
+                self._bytes += size
+        self._evict()
+
+    def _path(self, user_id, kind, version, extension):
+        return os.path.join(self.directory, f"{user_id}_{kind}_{version}.{extension}")
+
+    def get(self, user_id, kind, version, extension):
+        """Возвращает (file_id, путь к файлу); оба None при промахе."""
+        key = (user_id, kind, version)
+        path = self._path(user_id, kind, version, extension)
+        file_id = self._file_ids.get(key)
+        if file_id is None and path not in self._sizes:
+            self.misses += 1
+            return None, None
+        if path in self._sizes:
+            try:
+                # Отмечаем использование для вытеснения по давности
+                os.utime(path)
+            except FileNotFoundError:
+                # Файл удалён в обход кэша: считаем промахом, отчёт соберётся заново
+                self._bytes -= self._sizes.pop(path)
+                self._file_ids.pop(key, None)
+                self.misses += 1
+                return None, None
+            self.hits += 1
+            return file_id, path
+        self.hits += 1
+        return file_id, None
+
+    def put(self, user_id, kind, version, extension, source_path):
+        """Переносит готовый отчёт в кэш и возвращает его новый путь."""
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return source_path
+        self._drop_user(user_id, kind)
+        path = self._path(user_id, kind, version, extension)
+        os.replace(source_path, path)
+        self._sizes[path] = size
+        self._bytes += size
+        self._evict(keep=path)
+        return path
+
+    def contains(self, path):
+        return path in self._sizes
+
+    def remember_file_id(self, user_id, kind, version, file_id):
+        if file_id:
+            self._file_ids[(user_id, kind, version)] = file_id
+
+    def clear(self):
+        for path in list(self._sizes):
+            self._remove(path)
+        self._file_ids.clear()
+
+    def stats(self):
+        return {
+            "files": len(self._sizes),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _drop_user(self, user_id, kind):
+        # Отчёты по старым версиям данных больше не понадобятся
+        prefix = os.path.join(self.directory, f"{user_id}_{kind}_")
+        for path in [p for p in self._sizes if p.startswith(prefix)]:
+            self._remove(path)
+        for key in [k for k in self._file_ids if k[:2] == (user_id, kind)]:
+            del self._file_ids[key]
+
+    def _evict(self, keep=None):
+        if self._bytes <= self.max_bytes:
+            return
+        by_age = sorted(
+            (p for p in self._sizes if p != keep),
+            key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0
+        )
+        for path in by_age:
+            if self._bytes <= self.max_bytes:
+                break
+            self._remove(path)
+
+    def _remove(self, path):
+        self._bytes -= self._sizes.pop(path, 0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logging.warning("Не удалось удалить файл кэша экспорта %s", path)
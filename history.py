@@ -0,0 +1,128 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from money import AMOUNT_CENTS, format_amount
+
+# Постраничный просмотр расходов с keyset-пагинацией по (date, id).
+# Курсор страницы передаётся прямо в callback_data кнопок навигации:
+#   page:<режим>:<направление>:<номер страницы>:<id>:<date>
+# Режимы: view - история, edit - выбор записи для редактирования,
+# delete - выбор записи для удаления.
+
+PAGE_PREFIX = "page:"
+
+PAGE_SIZES = {
+    "view": 10,
+    "edit": 5,
+    "delete": 10,
+}
+
+HISTORY_COLUMNS = f"id, {AMOUNT_CENTS}, category, description, date"
+
+
+async def fetch_page(conn, user_id, mode, direction="next", cursor=None):
+    """Возвращает (строки страницы от новых к старым, есть ли ещё страницы в направлении)."""
+    limit = PAGE_SIZES[mode]
+    if cursor is None:
+        rows = await conn.execute_fetchall(
+            f"SELECT {HISTORY_COLUMNS} FROM expenses WHERE user_id = ? "
+            "ORDER BY date DESC, id DESC LIMIT ?",
+            (user_id, limit + 1)
+        )
+    elif direction == "next":
+        # Более старые записи
+        rows = await conn.execute_fetchall(
+            f"SELECT {HISTORY_COLUMNS} FROM expenses WHERE user_id = ? AND (date, id) < (?, ?) "
+            "ORDER BY date DESC, id DESC LIMIT ?",
+            (user_id, cursor[1], cursor[0], limit + 1)
+        )
+    else:
+        # Более новые записи: идём по индексу вверх и разворачиваем
+        rows = await conn.execute_fetchall(
+            f"SELECT {HISTORY_COLUMNS} FROM expenses WHERE user_id = ? AND (date, id) > (?, ?) "
+            "ORDER BY date ASC, id ASC LIMIT ?",
+            (user_id, cursor[1], cursor[0], limit + 1)
+        )
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+    if direction == "prev" and cursor is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+def parse_page_callback(data):
+    """Разбирает callback_data кнопки навигации в (режим, направление, номер страницы, курсор).
+
+    callback_data присылает клиент, поэтому при неизвестном режиме или
+    направлении, как и при неверном формате, - ValueError.
+    """
+    _, mode, direction, page, expense_id, date = data.split(":", 5)
+    if mode not in PAGE_SIZES:
+        raise ValueError(f"неизвестный режим: {mode}")
+    if direction not in ("next", "prev"):
+        raise ValueError(f"неизвестное направление: {direction}")
+    return mode, direction, int(page), (int(expense_id), date)
+
+
+def _nav_button(text, mode, direction, page, row):
+    expense_id, date = row[0], row[4]
+    return InlineKeyboardButton(
+        text=text,
+        callback_data=f"{PAGE_PREFIX}{mode}:{direction}:{page}:{expense_id}:{date}"
+    )
+
+
+def build_page(mode, rows, page, has_prev, has_next):
+    """Собирает текст и клавиатуру страницы для выбранного режима."""
+    keyboard = []
+    if mode == "view":
+        if page == 1:
+            response = f"📝 Последние {PAGE_SIZES[mode]} расходов:\n\n"
+        else:
+            response = f"📝 Расходы, страница {page}:\n\n"
+        for expense_id, amount, category, description, date in rows:
+            response += f"🆔 ID: {expense_id}\n"
+            response += f"💰 Сумма: {format_amount(amount)} руб.\n"
+            response += f"📁 Категория: {category}\n"
+            response += f"📝 Описание: {description}\n"
+            response += f"📅 Дата: {date}\n\n"
+    elif mode == "edit":
+        response = "📝 Выберите запись для редактирования:\n\n"
+        for expense_id, amount, category, description, date in rows:
+            response += f"🆔 ID: {expense_id}\n"
+            response += f"💰 Сумма: {format_amount(amount)} руб.\n"
+            response += f"📁 Категория: {category}\n"
+            response += f"📅 Дата: {date}\n\n"
+
+            keyboard.append([InlineKeyboardButton(
+                text=f"ID: {expense_id} | {format_amount(amount)} руб. | {category}",
+                callback_data=f"edit_select_{expense_id}"
+            )])
+    else:
+        response = "🗑 Выберите расход для удаления:\n\n"
+        if page == 1:
+            response += f"📝 Последние {PAGE_SIZES[mode]} записей:"
+        else:
+            response += f"📝 Записи, страница {page}:"
+        for expense_id, amount, category, description, date in rows:
+            button_text = f"💰 {format_amount(amount)} руб. | {category} | {description[:20]}..."
+            keyboard.append([InlineKeyboardButton(
+                text=button_text,
+                callback_data=f"delete_{expense_id}"
+            )])
+
+    # Навигация: курсором служит первая или последняя запись страницы
+    navigation = []
+    if has_prev and rows:
+        navigation.append(_nav_button("⬅️ Новее", mode, "prev", page - 1, rows[0]))
+    if has_next and rows:
+        navigation.append(_nav_button("Старее ➡️", mode, "next", page + 1, rows[-1]))
+    if navigation:
+        keyboard.append(navigation)
+
+    if mode == "edit":
+        keyboard.append([InlineKeyboardButton(text="❌ Отмена", callback_data="edit_cancel")])
+    elif mode == "delete":
+        keyboard.append([InlineKeyboardButton(text="❌ Отмена", callback_data="delete_cancel")])
+
+    reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
+    return response, reply_markup
@@ -0,0 +1,247 @@
+import asyncio
+import csv
+import os
+import re
+from datetime import date, datetime
+
+import money
+import rollups
+import search
+from database import bump_data_version
+
+# Импорт расходов из CSV и XLSX. Файл читается потоково (csv.reader,
+# openpyxl в режиме read_only) порциями в отдельном потоке, поэтому цикл
+# событий не блокируется. Разобранные строки записываются одной транзакцией
+# большими пакетами executemany вместе с итогами и поисковым индексом.
+
+IMPORT_SUFFIXES = (".csv", ".xlsx")
+# Порядок колонок без заголовка - как в выгрузке в Excel
+DEFAULT_COLUMNS = ("date", "amount", "category", "description")
+HEADER_ALIASES = {
+    "date": ("дата", "date", "время", "дата и время"),
+    "amount": ("сумма", "amount", "сумма, руб.", "сумма (руб.)", "руб."),
+    "category": ("категория", "category"),
+    "description": ("описание", "description", "комментарий", "назначение"),
+}
+# Даты вида 2024-12-31[ 23:59[:59]] и 31.12.2024[ 23:59[:59]] (год может быть двузначным).
+# Регулярные выражения вместо strptime: на сотнях тысяч строк strptime - самая дорогая часть
+_ISO_DATE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+_RU_DATE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4}|\d{2})(?:,?\s+(\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+MAX_DESCRIPTION_LENGTH = 1000
+# Сколько ошибок в строках показывать пользователю
+MAX_REPORTED_ERRORS = 5
+
+INSERT_EXPENSE = (
+    "INSERT INTO expenses (user_id, amount_cents, category, description, date) "
+    "VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"
+)
+
+_AMOUNT_NOISE = re.compile(r"[\s₽]|руб\.?|р\.", re.IGNORECASE)
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+class ImportTooLarge(Exception):
+    pass
+
+
+def category_lookup(categories):
+    """Сопоставление «подпись кнопки или название в любом регистре» -> категория."""
+    lookup = {}
+    for label, category in categories.items():
+        lookup[label.casefold()] = category
+        lookup[category.casefold()] = category
+    return lookup
+
+
+def parse_amount(value):
+    """Сумма из ячейки в копейках."""
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"некорректная сумма «{value}»")
+    if isinstance(value, float):
+        # Число из XLSX: repr даёт кратчайшую запись, 0.1 не превращается в 0.1000000000000000055
+        return money.parse_amount(repr(value))
+    if isinstance(value, int):
+        return money.parse_amount(value)
+    return money.parse_amount(_AMOUNT_NOISE.sub("", str(value)))
+
+
+def parse_date(value):
+    # Пустая дата - момент импорта
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d 00:00:00")
+    text = str(value).strip()
+    if not text:
+        return None
+    match = _ISO_DATE.fullmatch(text)
+    if match:
+        year, month, day, hour, minute, second = match.groups()
+    else:
+        match = _RU_DATE.fullmatch(text)
+        if not match:
+            raise ValueError(f"некорректная дата «{value}»")
+        day, month, year, hour, minute, second = match.groups()
+        if len(year) == 2:
+            year = "20" + year
+    try:
+        # Конструктор datetime проверяет, что такой день существует
+        parsed = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+    except ValueError:
+        raise ValueError(f"некорректная дата «{value}»") from None
+    return parsed.isoformat(" ")
+
+
+def _iter_csv_rows(path):
+    # utf-8-sig убирает BOM, который добавляет Excel; разделитель определяется по началу файла
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        sample = file.read(64 * 1024)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(file, dialect)
+
+
+def _iter_xlsx_rows(path):
+    # openpyxl нужен только для импорта, поэтому загружается при первом XLSX
+    import openpyxl
+
+    try:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFormatError("не удалось открыть файл Excel") from e
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_rows(path):
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".csv":
+        return _iter_csv_rows(path)
+    if suffix == ".xlsx":
+        return _iter_xlsx_rows(path)
+    raise ImportFormatError("поддерживаются только файлы CSV и XLSX")
+
+
+def _header_columns(row):
+    """Колонки по строке заголовка или None, если это строка с данными."""
+    names = [str(cell or "").strip().casefold() for cell in row]
+    columns = {}
+    for field, aliases in HEADER_ALIASES.items():
+        for index, name in enumerate(names):
+            if name in aliases:
+                columns[field] = index
+                break
+    if "amount" not in columns:
+        return None
+    return columns
+
+
+class ExpenseParser:
+    """Проверяет строки файла и превращает их в кортежи для вставки."""
+
+    def __init__(self, categories, fallback_category, max_rows):
+        self.categories = category_lookup(categories)
+        self.fallback_category = fallback_category
+        self.max_rows = max_rows
+        self.columns = None
+        self.rows = []
+        self.read = 0
+        self.skipped = 0
+        self.recategorized = 0
+        self.errors = []
+
+    def _cell(self, row, field):
+        index = self.columns.get(field)
+        if index is None or index >= len(row):
+            return None
+        return row[index]
+
+    def _parse(self, row):
+        amount = parse_amount(self._cell(row, "amount"))
+        category_name = str(self._cell(row, "category") or "").strip()
+        category = self.categories.get(category_name.casefold())
+        if category is None:
+            # Незнакомые категории попадают в «Другое», а не отбрасывают строку
+            category = self.fallback_category
+            self.recategorized += 1
+        description = str(self._cell(row, "description") or "").strip()[:MAX_DESCRIPTION_LENGTH]
+        return amount, category, description, parse_date(self._cell(row, "date"))
+
+    def feed(self, rows, first_line):
+        for line, row in enumerate(rows, first_line):
+            if not any(cell not in (None, "") for cell in row):
+                continue
+            if self.columns is None:
+                self.columns = _header_columns(row)
+                if self.columns is not None:
+                    continue
+                self.columns = dict(zip(DEFAULT_COLUMNS, range(len(DEFAULT_COLUMNS))))
+            self.read += 1
+            if len(self.rows) >= self.max_rows:
+                raise ImportTooLarge()
+            try:
+                self.rows.append(self._parse(row))
+            except ValueError as e:
+                self.skipped += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append(f"строка {line}: {e}")
+
+
+def _read_chunk(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+
+async def read_expenses(path, categories, fallback_category, max_rows, chunk_size=5000, on_progress=None):
+    """Разбирает файл порциями в отдельном потоке; on_progress(прочитано) после каждой."""
+    parser = ExpenseParser(categories, fallback_category, max_rows)
+    rows = iter_rows(path)
+    line = 1
+    try:
+        while True:
+            # Чтение и разбор порции идут в потоке, между порциями цикл событий свободен
+            chunk = await asyncio.to_thread(_read_chunk, rows, chunk_size)
+            if not chunk:
+                break
+            await asyncio.to_thread(parser.feed, chunk, line)
+            line += len(chunk)
+            if on_progress is not None:
+                await on_progress(parser.read)
+    except UnicodeDecodeError as e:
+        raise ImportFormatError("файл CSV должен быть в кодировке UTF-8") from e
+    except csv.Error as e:
+        raise ImportFormatError(f"не удалось разобрать CSV: {e}") from e
+    finally:
+        rows.close()
+    return parser
+
+
+async def insert_expenses(conn, user_id, rows, batch_size=5000):
+    """Вставляет расходы пакетами executemany в текущей транзакции."""
+    cursor = await conn.execute("SELECT COALESCE(MAX(id), 0) FROM expenses")
+    last_id = (await cursor.fetchone())[0]
+    await search.pause_indexing(conn)
+    for start in range(0, len(rows), batch_size):
+        await conn.executemany(
+            INSERT_EXPENSE,
+            [(user_id, *row) for row in rows[start:start + batch_size]]
+        )
+    # Итоги и поисковый индекс пересчитываются одним запросом по всем новым строкам
+    await rollups.apply_new_expenses(conn, user_id, last_id)
+    await search.index_new_expenses(conn, last_id)
+    await bump_data_version(conn, user_id)
+    return len(rows)
@@ -0,0 +1,215 @@
+import bisect
+import logging
+import re
+import time
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+# Метрики в текстовом формате Prometheus без сторонних зависимостей:
+# счётчики и гистограммы с метками плюс снимки stats() существующих
+# компонентов (кэши, очереди, планировщик отправки). Всё отдаётся на
+# локальном HTTP-эндпоинте /metrics.
+
+# Границы гистограмм длительности, в секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Границы гистограмм размера, в байтах
+SIZE_BUCKETS = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8)
+
+_metrics = []
+_collectors = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: [счётчики по корзинам..., сумма, количество]
+        self._values = {}
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        series = self._values.get(label_values)
+        if series is None:
+            series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        _metrics.append(self)
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def register_stats(prefix, stats):
+    """Публикует числовые поля stats() компонента как метрики prefix_<поле>."""
+    _collectors.append((prefix, stats))
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, stats in _collectors:
+        try:
+            values = stats()
+        except Exception:
+            logging.exception("Не удалось собрать метрики %s", prefix)
+            continue
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика", ("handler",)
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения, вышедшие из обработчика", ("handler",)
+)
+SQL_LATENCY = Histogram(
+    "bot_sql_duration_seconds", "Время выполнения SQL-запроса", ("statement",)
+)
+EXPORT_LATENCY = Histogram(
+    "bot_export_render_seconds", "Время формирования отчёта", ("kind",)
+)
+EXPORT_SIZE = Histogram(
+    "bot_export_size_bytes", "Размер готового отчёта", ("kind",), buckets=SIZE_BUCKETS
+)
+EXPORT_RESULTS = Counter(
+    "bot_exports_total", "Запросы на формирование отчёта по итогу", ("kind", "result")
+)
+IMPORT_LATENCY = Histogram(
+    "bot_import_seconds", "Время импорта файла от загрузки до записи", ("kind",)
+)
+IMPORT_ROWS = Counter(
+    "bot_import_rows_total", "Строки импортированных файлов по итогу", ("result",)
+)
+DB_MAINTENANCE_LATENCY = Histogram(
+    "bot_db_maintenance_seconds", "Время обслуживания базы: контрольная точка WAL или optimize",
+    ("database", "operation")
+)
+DB_WAL_BYTES = Gauge(
+    "bot_db_wal_bytes", "Размер файла WAL на диске", ("database",)
+)
+DB_WAL_FRAMES = Gauge(
+    "bot_db_wal_frames", "Кадры WAL, не перенесённые в базу последней контрольной точкой", ("database",)
+)
+
+_STATEMENT_TABLE = re.compile(
+    r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([A-Za-z_][A-Za-z0-9_]*)",
+    re.IGNORECASE
+)
+_statement_labels = {}
+
+
+def statement_label(sql):
+    """Короткая метка запроса «операция таблица», например «SELECT expenses»."""
+    label = _statement_labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        operation = words[0].upper() if words else "?"
+        match = _STATEMENT_TABLE.search(sql)
+        label = f"{operation} {match.group(1)}" if match else operation
+        # Запросы в приложении фиксированные, но на всякий случай кэш ограничен
+        if len(_statement_labels) < 1000:
+            _statement_labels[sql] = label
+    return label
+
+
+def observe_sql(sql, started):
+    SQL_LATENCY.observe(time.perf_counter() - started, statement_label(sql))
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика по имени его функции."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host, port):
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на http://%s:%d/metrics", host, port)
+    return runner
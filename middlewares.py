@@ -0,0 +1,115 @@
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from send_queue import TokenBucket
+
+EXPORT_PREFIX = "export_"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Отсекает лишние входящие обновления до обработчиков.
+
+    - у каждого пользователя свой токен-бакет: сверх лимита обновления отбрасываются;
+    - повторное нажатие той же inline-кнопки в течение окна игнорируется;
+    - у пользователя одновременно формируется не больше одного экспорта
+      и загружается не больше одного файла импорта.
+    """
+
+    def __init__(self, rate=2, burst=5, dedup_window=1.0, max_users=100000):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+        self._recent = OrderedDict()
+        self._busy = set()
+        self._warned = set()
+        self.throttled = 0
+        self.duplicates = 0
+        self.busy_exports = 0
+        self.busy_imports = 0
+
+    def _bucket(self, user_id):
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_users:
+                forgotten, _ = self._buckets.popitem(last=False)
+                self._warned.discard(forgotten)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket
+
+    def _is_duplicate(self, user_id, data):
+        now = time.monotonic()
+        # Записи лежат по времени: всё старше окна отрезается с начала
+        while self._recent:
+            key, seen = next(iter(self._recent.items()))
+            if now - seen <= self.dedup_window:
+                break
+            self._recent.popitem(last=False)
+        key = (user_id, data)
+        if key in self._recent:
+            return True
+        self._recent[key] = now
+        return False
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        is_callback = isinstance(event, CallbackQuery)
+
+        if is_callback and self._is_duplicate(user.id, event.data):
+            self.duplicates += 1
+            await event.answer()
+            return None
+
+        bucket = self._bucket(user.id)
+        if bucket.delay() > 0:
+            self.throttled += 1
+            # Сообщением предупреждаем один раз за серию, остальное отбрасываем молча;
+            # ответ на callback ничего не стоит и убирает «часики» с кнопки
+            if is_callback or user.id not in self._warned:
+                await event.answer("⏳ Слишком много запросов, подождите немного")
+            self._warned.add(user.id)
+            logging.debug("Пользователь %s превысил лимит запросов", user.id)
+            return None
+        bucket.take()
+        self._warned.discard(user.id)
+
+        if is_callback and event.data and event.data.startswith(EXPORT_PREFIX):
+            if (user.id, "export") in self._busy:
+                self.busy_exports += 1
+                await event.answer("⏳ Отчёт уже формируется")
+                return None
+            return await self._exclusive(handler, event, data, (user.id, "export"))
+
+        if isinstance(event, Message) and event.document is not None:
+            if (user.id, "import") in self._busy:
+                self.busy_imports += 1
+                await event.answer("⏳ Предыдущий файл ещё загружается")
+                return None
+            return await self._exclusive(handler, event, data, (user.id, "import"))
+
+        return await handler(event, data)
+
+    async def _exclusive(self, handler, event, data, key):
+        self._busy.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._busy.discard(key)
+
+    def stats(self):
+        return {
+            "users": len(self._buckets),
+            "throttled": self.throttled,
+            "duplicates": self.duplicates,
+            "busy_exports": self.busy_exports,
+            "busy_imports": self.busy_imports,
+        }
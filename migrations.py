@@ -0,0 +1,229 @@
+import logging
+from datetime import datetime
+
+# Версионированные миграции схемы: (версия, описание, SQL-операторы).
+# Каждая миграция применяется в отдельной транзакции вместе с записью своей
+# версии, поэтому существующие базы обновляются на месте при старте бота.
+# Миграции не обязаны быть идемпотентными (ALTER TABLE в миграции 8): после
+# сбоя посередине в SQLite откатываются и изменения схемы, и миграция при
+# следующем старте выполняется целиком заново.
+MIGRATIONS = [
+    (1, "Таблица расходов", [
+        """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            category TEXT,
+            description TEXT,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Индекс по (user_id, date) для статистики и истории", [
+        # Префикс (user_id, date) отдаёт последние записи пользователя без сортировки,
+        # а category и amount делают индекс покрывающим для SUM/GROUP BY статистики
+        "CREATE INDEX IF NOT EXISTS idx_expenses_user_date "
+        "ON expenses (user_id, date, category, amount)",
+    ]),
+    (3, "Дневные итоги по категориям для статистики", [
+        """
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT,
+            sum REAL NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, category)
+        ) WITHOUT ROWID
+        """,
+        # Заполнение по уже существующим расходам
+        """
+        INSERT OR REPLACE INTO daily_totals (user_id, day, category, sum, count)
+        SELECT user_id, date(date), category, SUM(amount), COUNT(*)
+        FROM expenses
+        GROUP BY user_id, date(date), category
+        """,
+    ]),
+    (4, "Версии данных пользователей для кэша экспорта", [
+        """
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+    (5, "Индекс (user_id, date, id) для постраничной истории", [
+        # Ключ пагинации (date, id) целиком лежит в индексе: каждая страница -
+        # один поиск по индексу без досортировки, на любой глубине
+        "CREATE INDEX IF NOT EXISTS idx_expenses_user_date_id ON expenses (user_id, date, id)",
+        # Статистика читается из daily_totals, покрывающий индекс больше не нужен
+        "DROP INDEX IF EXISTS idx_expenses_user_date",
+    ]),
+    (6, "Хранилище состояний FSM", [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)",
+    ]),
+    (7, "Карта бакетов пользователей по шардам", [
+        # Заполняется и используется только в главном шарде
+        """
+        CREATE TABLE IF NOT EXISTS shard_buckets (
+            bucket INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (8, "Суммы в копейках", [
+        # Старые значения amount переводятся в amount_cents в фоне (money.migrate_amounts),
+        # поэтому миграция только добавляет столбец и не переписывает таблицу расходов
+        "ALTER TABLE expenses ADD COLUMN amount_cents INTEGER",
+        # Дневные итоги небольшие, их проще пересчитать сразу в копейках
+        """
+        CREATE TABLE daily_totals_cents (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT,
+            sum_cents INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, category)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO daily_totals_cents (user_id, day, category, sum_cents, count)
+        SELECT user_id, date(date), category, SUM(CAST(ROUND(amount * 100) AS INTEGER)), COUNT(*)
+        FROM expenses
+        GROUP BY user_id, date(date), category
+        """,
+        "DROP TABLE daily_totals",
+        "ALTER TABLE daily_totals_cents RENAME TO daily_totals",
+    ]),
+    (9, "Итоги по календарным неделям и месяцам", [
+        # grain - 'week' или 'month', period - дата начала недели (понедельник) или месяца
+        """
+        CREATE TABLE IF NOT EXISTS period_totals (
+            user_id INTEGER NOT NULL,
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            category TEXT,
+            sum_cents INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, grain, period, category)
+        ) WITHOUT ROWID
+        """,
+        # Заполнение по уже существующим дневным итогам
+        """
+        INSERT OR REPLACE INTO period_totals (user_id, grain, period, category, sum_cents, count)
+        SELECT user_id, 'week', date(day, 'weekday 0', '-6 days'), category, SUM(sum_cents), SUM(count)
+        FROM daily_totals
+        GROUP BY user_id, date(day, 'weekday 0', '-6 days'), category
+        """,
+        """
+        INSERT OR REPLACE INTO period_totals (user_id, grain, period, category, sum_cents, count)
+        SELECT user_id, 'month', date(day, 'start of month'), category, SUM(sum_cents), SUM(count)
+        FROM daily_totals
+        GROUP BY user_id, date(day, 'start of month'), category
+        """,
+    ]),
+    (10, "Полнотекстовый поиск по описаниям", [
+        # Индекс FTS5 над таблицей расходов без копии текста (external content).
+        # user_id индексируется как отдельная колонка, чтобы поиск сразу шёл
+        # только по расходам пользователя. «ё» заменяется на «е» и в индексе,
+        # и в запросе (search.normalize); поэтому команду 'rebuild' не использовать
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+            user_id,
+            description,
+            content='expenses',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+        """,
+        # Ранжирование только по описанию
+        "INSERT INTO expenses_fts (expenses_fts, rank) VALUES ('rank', 'bm25(0.0, 1.0)')",
+        """
+        INSERT INTO expenses_fts (rowid, user_id, description)
+        SELECT id, user_id, replace(replace(description, 'ё', 'е'), 'Ё', 'Е') FROM expenses
+        """,
+        # Пока в таблице есть строка, триггер вставки не индексирует расходы: импорт и
+        # перенос между шардами вставляют много строк и индексируют их одним запросом
+        # (search.pause_indexing и search.index_new_expenses в той же транзакции)
+        "CREATE TABLE IF NOT EXISTS expenses_fts_paused (id INTEGER PRIMARY KEY)",
+        # Триггеры держат индекс в той же транзакции, что и изменение расхода
+        """
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses
+        WHEN NOT EXISTS (SELECT 1 FROM expenses_fts_paused) BEGIN
+            INSERT INTO expenses_fts (rowid, user_id, description)
+            VALUES (new.id, new.user_id, replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е'));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, user_id, description)
+            VALUES ('delete', old.id, old.user_id, replace(replace(old.description, 'ё', 'е'), 'Ё', 'Е'));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF user_id, description ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, user_id, description)
+            VALUES ('delete', old.id, old.user_id, replace(replace(old.description, 'ё', 'е'), 'Ё', 'Е'));
+            INSERT INTO expenses_fts (rowid, user_id, description)
+            VALUES (new.id, new.user_id, replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е'));
+        END
+        """,
+    ]),
+    (11, "Месячные бюджеты по категориям", [
+        # Потраченное за месяц берётся из period_totals, здесь хранятся только лимиты
+        """
+        CREATE TABLE IF NOT EXISTS budgets (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            limit_cents INTEGER NOT NULL,
+            PRIMARY KEY (user_id, category)
+        ) WITHOUT ROWID
+        """,
+    ]),
+]
+
+
+async def get_schema_version(conn):
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+        """
+    )
+    rows = await conn.execute_fetchall("SELECT MAX(version) FROM schema_version")
+    return rows[0][0] or 0
+
+
+async def migrate(db):
+    """Применяет все ещё не применённые миграции и возвращает версию схемы."""
+    async with db.writer() as conn:
+        current = await get_schema_version(conn)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        async with db.writer() as conn:
+            await conn.execute("BEGIN")
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute(
+                "INSERT OR IGNORE INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat(timespec="seconds"))
+            )
+        logging.info("Применена миграция %d: %s", version, description)
+        current = version
+
+    return current
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Суммы хранятся в копейках целыми числами (expenses.amount_cents,
+# daily_totals.sum_cents): суммирование в SQLite точное и быстрее, чем по REAL.
+# В рубли значение переводится только при выводе.
+#
+# Старые строки со значением в amount REAL переписываются в фоне пакетами
+# (migrate_amounts). Пока перенос не закончен, чтение идёт через AMOUNT_CENTS:
+# у перенесённых и новых строк это amount_cents, у остальных - пересчёт из amount.
+
+AMOUNT_CENTS = "COALESCE(amount_cents, CAST(ROUND(amount * 100) AS INTEGER))"
+
+_CENT = Decimal("0.01")
+# Триллион рублей: с запасом для любых расходов и далеко от предела INTEGER в SQLite
+MAX_CENTS = 10 ** 14
+
+
+def parse_amount(value):
+    """Сумма из ввода пользователя (строка или число) в копейках; ValueError, если некорректна."""
+    text = str(value).strip().replace(",", ".")
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"некорректная сумма «{value}»") from None
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError(f"сумма должна быть больше нуля: «{value}»")
+    if amount * 100 > MAX_CENTS:
+        raise ValueError(f"слишком большая сумма «{value}»")
+    cents = int(amount.quantize(_CENT, rounding=ROUND_HALF_UP) * 100)
+    if cents <= 0:
+        raise ValueError(f"сумма должна быть больше нуля: «{value}»")
+    return cents
+
+
+def format_amount(cents, thousands=""):
+    """1234567 -> «12345.67»; thousands - разделитель разрядов рублей."""
+    sign = "-" if cents < 0 else ""
+    rubles, kopecks = divmod(abs(cents), 100)
+    return f"{sign}{rubles:,}.{kopecks:02d}".replace(",", thousands)
+
+
+def to_decimal(cents):
+    """Точное значение в рублях для ячеек Excel."""
+    return Decimal(cents).scaleb(-2)
+
+
+async def _convert_range(conn, first_id, last_id):
+    cursor = await conn.execute(
+        """
+        UPDATE expenses
+        SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER), amount = NULL
+        WHERE id BETWEEN ? AND ? AND amount_cents IS NULL AND amount IS NOT NULL
+        """,
+        (first_id, last_id)
+    )
+    return cursor.rowcount
+
+
+async def migrate_amounts(db, queue, batch_size=5000, pause=0.01):
+    """Переносит суммы из amount в amount_cents диапазонами id через очередь записи.
+
+    Каждый диапазон - отдельная короткая транзакция, между ними запись
+    пользователей идёт как обычно. Повторный запуск продолжает с места остановки.
+    """
+    converted = 0
+    while True:
+        async with db.reader() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT MIN(id), MAX(id) FROM expenses WHERE amount_cents IS NULL AND amount IS NOT NULL"
+            )
+        first_id, last_id = rows[0]
+        if first_id is None:
+            break
+        # Строки, скопированные переносом бакетов во время прохода, найдутся на следующем круге
+        for start in range(first_id, last_id + 1, batch_size):
+            end = min(start + batch_size - 1, last_id)
+            converted += await queue.submit(lambda conn: _convert_range(conn, start, end))
+            await asyncio.sleep(pause)
+    if converted:
+        logging.info("Суммы в %s переведены в копейки: %d строк", db.path, converted)
+    return converted
@@ -0,0 +1,259 @@
+import sqlite3
+from datetime import datetime
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
+from openpyxl.utils import get_column_letter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, PageBreak, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+from money import AMOUNT_CENTS, format_amount, to_decimal
+
+# Формирование отчётов Excel и PDF. Модуль импортируется только в процессах
+# пула отчётов, при первом экспорте: сам бот openpyxl и reportlab не загружает.
+# Функции читают базу только на чтение и пишут отчёт в файл, путь к которому
+# передал бот; стили и константы строятся один раз на процесс.
+
+# Строки экспорта читаются из курсора порциями, а не целиком
+EXPORT_CHUNK_SIZE = 1000
+# Строк таблицы на одной странице PDF
+PDF_ROWS_PER_PAGE = 30
+
+EXPORT_QUERY = f"""SELECT
+    strftime('%d.%m.%Y %H:%M', date) as formatted_date,
+    {AMOUNT_CENTS} as amount_cents,
+    COALESCE(category, '-') as category,
+    COALESCE(description, '-') as description
+FROM expenses
+WHERE user_id = ?
+ORDER BY date DESC"""
+
+EXCEL_HEADERS = ["Дата", "Сумма", "Категория", "Описание"]
+
+
+
+def iter_expense_chunks(db_path, user_id, chunk_size=EXPORT_CHUNK_SIZE):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    try:
+        cursor = conn.execute(EXPORT_QUERY, (user_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def _excel_styles():
+    # Именованные стили хранятся в книге один раз и разделяются всеми ячейками
+    header = NamedStyle(name="export_header")
+    header.font = Font(bold=True)
+    header.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
+    header.alignment = Alignment(horizontal="center")
+
+    date = NamedStyle(name="export_date")
+    date.alignment = Alignment(horizontal="center")
+
+    amount = NamedStyle(name="export_amount")
+    amount.number_format = '#,##0.00'
+    return header, date, amount
+
+
+def render_excel(db_path, user_id, output_path):
+    """Пишет отчёт в книгу write-only режима и возвращает число строк."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Расходы")
+    header_style, date_style, amount_style = _excel_styles()
+    for style in (header_style, date_style, amount_style):
+        wb.add_named_style(style)
+
+    # В write-only режиме ширину столбцов задаём до записи строк
+    for col in range(1, len(EXCEL_HEADERS) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 20
+
+    header_row = []
+    for header in EXCEL_HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.style = header_style.name
+        header_row.append(cell)
+    ws.append(header_row)
+
+    count = 0
+    for rows in iter_expense_chunks(db_path, user_id):
+        for date, amount, category, description in rows:
+            date_cell = WriteOnlyCell(ws, value=date)
+            date_cell.style = date_style.name
+            # Decimal записывается в книгу точно, без двоичной погрешности float
+            amount_cell = WriteOnlyCell(ws, value=to_decimal(amount))
+            amount_cell.style = amount_style.name
+            ws.append([date_cell, amount_cell, category, description])
+        count += len(rows)
+
+    wb.save(output_path)
+    return count
+
+
+def _pdf_table_style(total_rows):
+    # Последние total_rows строк блока - итоговые
+    last_row = -1 - total_rows
+    return TableStyle([
+        # Заголовок таблицы
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#333333')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+
+        # Основное содержимое
+        ('ALIGN', (0, 1), (0, last_row), 'CENTER'),  # Дата по центру
+        ('ALIGN', (1, 1), (1, -1), 'RIGHT'),         # Сумма справа
+        ('ALIGN', (2, 1), (2, last_row), 'CENTER'),  # Категория по центру
+        ('ALIGN', (3, 1), (3, last_row), 'LEFT'),    # Описание слева
+
+        # Итоговые строки
+        ('BACKGROUND', (0, last_row + 1), (-1, -1), colors.HexColor('#f5f5f5')),
+        ('FONTNAME', (0, last_row + 1), (-1, -1), 'Helvetica-Bold'),
+        ('ALIGN', (2, last_row + 1), (3, -1), 'RIGHT'),
+
+        # Границы и отступы
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('BOX', (0, 0), (-1, -1), 2, colors.black),
+        ('LEFTPADDING', (0, 0), (-1, -1), 6),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+
+        # Шрифты для содержимого
+        ('FONTSIZE', (0, 1), (-1, last_row), 10),
+        ('FONTNAME', (0, 1), (-1, last_row), 'Helvetica'),
+    ])
+
+
+# Стили таблиц строятся один раз и разделяются всеми блоками
+PDF_PAGE_STYLE = _pdf_table_style(2)
+PDF_SINGLE_PAGE_STYLE = _pdf_table_style(1)
+PDF_GRAND_TOTAL_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f5f5f5')),
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+    ('ALIGN', (2, 0), (3, 0), 'RIGHT'),
+    ('BOX', (0, 0), (-1, -1), 2, colors.black),
+    ('LEFTPADDING', (0, 0), (-1, -1), 6),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+])
+PDF_COL_WIDTHS = [100, 80, 100, 250]
+
+_PDF_STYLES = getSampleStyleSheet()
+PDF_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_PDF_STYLES['Heading1'],
+    fontSize=20,
+    spaceAfter=30,
+    alignment=1
+)
+PDF_DATE_STYLE = ParagraphStyle(
+    'DateStyle',
+    parent=_PDF_STYLES['Normal'],
+    fontSize=8,
+    textColor=colors.gray,
+    alignment=2,  # Справа
+    spaceAfter=0,
+    spaceBefore=20,
+)
+
+
+class _FlowableStream(list):
+    """Список флоуаблов, который подкачивает элементы из генератора по мере вёрстки.
+
+    SimpleDocTemplate.build забирает элементы с начала списка и на каждом шаге
+    проверяет его длину, поэтому в памяти одновременно живут только ближайшие блоки.
+    """
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+        self._exhausted = False
+
+    def __len__(self):
+        while not self._exhausted and super().__len__() < 2:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._exhausted = True
+        return super().__len__()
+
+
+def _iter_pdf_blocks(db_path, user_id, stats):
+    # Каждый блок - отдельная небольшая таблица на страницу: вёрстка остаётся
+    # линейной по числу строк, в отличие от одной огромной таблицы
+    chunks = iter_expense_chunks(db_path, user_id, PDF_ROWS_PER_PAGE)
+    current = next(chunks, None)
+    running_total = 0
+    single_page = True
+    while current is not None:
+        following = next(chunks, None)
+        data = [["Дата", "Сумма", "Категория", "Описание"]]
+        page_total = 0
+        for date, amount, category, description in current:
+            page_total += amount
+            data.append([date, format_amount(amount, ","), category, description])
+        running_total += page_total
+        stats["rows"] += len(current)
+
+        if single_page and following is None:
+            # Отчёт на одну страницу выглядит как раньше: одна строка ИТОГО
+            data.append(["", "", "ИТОГО:", format_amount(running_total, ",")])
+            table = Table(data, colWidths=PDF_COL_WIDTHS)
+            table.setStyle(PDF_SINGLE_PAGE_STYLE)
+            yield table
+            return
+
+        single_page = False
+        data.append(["", "", "Итого на странице:", format_amount(page_total, ",")])
+        data.append(["", "", "Нарастающий итог:", format_amount(running_total, ",")])
+        table = Table(data, colWidths=PDF_COL_WIDTHS)
+        table.setStyle(PDF_PAGE_STYLE)
+        yield table
+        if following is not None:
+            yield PageBreak()
+        current = following
+
+    if not single_page:
+        grand_total = Table([["", "", "ИТОГО:", format_amount(running_total, ",")]], colWidths=PDF_COL_WIDTHS)
+        grand_total.setStyle(PDF_GRAND_TOTAL_STYLE)
+        yield Spacer(1, 12)
+        yield grand_total
+
+
+def render_pdf(db_path, user_id, output_path):
+    """Строит PDF-отчёт постранично из курсора и возвращает число строк."""
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=letter,
+        rightMargin=30,
+        leftMargin=30,
+        topMargin=30,
+        bottomMargin=30
+    )
+
+    current_date = datetime.now().strftime("%d.%m.%Y %H:%M")
+    stats = {"rows": 0}
+
+    def flowables():
+        # Заголовок, блоки таблицы по страницам и дата создания отчета
+        yield Paragraph("Отчет о расходах", PDF_TITLE_STYLE)
+        yield from _iter_pdf_blocks(db_path, user_id, stats)
+        yield Paragraph(f"Отчет создан: {current_date}", PDF_DATE_STYLE)
+
+    # Создаем документ
+    doc.build(_FlowableStream(flowables()))
+    return stats["rows"]
+
+
+RENDERERS = {
+    "excel": render_excel,
+    "pdf": render_pdf,
+}
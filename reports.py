@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Расширения файлов отчётов по формату
+REPORT_SUFFIXES = {
+    "excel": ".xlsx",
+    "pdf": ".pdf",
+}
+
+
+class ReportQueueFull(Exception):
+    pass
+
+
+class ReportTimeout(Exception):
+    pass
+
+
+# Функции ниже выполняются в процессах пула. Тяжёлые openpyxl и reportlab
+# подгружаются вместе с модулем renderers при первом отчёте в процессе.
+
+def _render_job(kind, db_path, user_id, output_path):
+    from renderers import RENDERERS
+    return RENDERERS[kind](db_path, user_id, output_path)
+
+
+def _warm_up():
+    import renderers
+    return renderers.__name__
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ReportService:
+    """Формирует отчёты в пуле процессов, не блокируя цикл событий бота."""
+
+    def __init__(self, max_workers=2, max_concurrent=2, max_queue=20, timeout=120):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._executor = None
+        self._broken = False
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def start(self):
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки aiosqlite
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def warm_up(self):
+        """Запускает процессы пула и загружает в них модуль отчётов в фоне."""
+        for _ in range(self.max_workers):
+            self._executor.submit(_warm_up)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+        }
+
+    async def render(self, kind, db_path, user_id):
+        """Возвращает путь к готовому файлу; удалить его должен вызывающий."""
+        # Метрики нужны только боту: процессы пула импортируют этот модуль
+        # и не должны тянуть за собой aiohttp и aiogram
+        from metrics import EXPORT_LATENCY, EXPORT_RESULTS, EXPORT_SIZE
+
+        suffix = REPORT_SUFFIXES[kind]
+        if self.waiting >= self.max_queue:
+            EXPORT_RESULTS.inc(kind, "rejected")
+            raise ReportQueueFull()
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        if self._broken:
+            self.shutdown()
+            self.start()
+            self._broken = False
+
+        fd, output_path = tempfile.mkstemp(prefix="expenses_", suffix=suffix)
+        os.close(fd)
+        started = time.perf_counter()
+        self.running += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, _render_job, kind, db_path, user_id, output_path
+            )
+        except BaseException:
+            self.running -= 1
+            self._semaphore.release()
+            _remove_file(output_path)
+            raise
+
+        def job_done(done):
+            # Слот освобождается, только когда процесс действительно закончил работу,
+            # даже если бот уже перестал ждать его по таймауту
+            self.running -= 1
+            self._semaphore.release()
+            error = None if done.cancelled() else done.exception()
+            if done.cancelled() or error is not None:
+                self.failed += 1
+                EXPORT_RESULTS.inc(kind, "failed")
+            else:
+                self.completed += 1
+                EXPORT_RESULTS.inc(kind, "ok")
+                EXPORT_LATENCY.observe(time.perf_counter() - started, kind)
+                if os.path.exists(output_path):
+                    EXPORT_SIZE.observe(os.path.getsize(output_path), kind)
+            if isinstance(error, BrokenProcessPool):
+                # Процесс пула упал (например, по памяти) - пересоздадим пул при следующем отчёте
+                self._broken = True
+
+        future.add_done_callback(job_done)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except BaseException as e:
+            # Файл удаляем после завершения процесса, иначе он может создать его заново
+            future.add_done_callback(lambda _: _remove_file(output_path))
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                EXPORT_RESULTS.inc(kind, "timeout")
+                logging.warning("Отчёт %s для пользователя %s не уложился в %s с", kind, user_id, self.timeout)
+                raise ReportTimeout() from e
+            raise
+        return output_path
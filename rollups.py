@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import sys
+
+from money import AMOUNT_CENTS
+
+# Дневные итоги по категориям в копейках и такие же итоги по календарным
+# неделям и месяцам (period_totals). Поддерживаются в тех же транзакциях,
+# что и вставка, изменение и удаление расходов, поэтому статистика за любой
+# период читает несколько крупных корзин и крайние дни вместо всех расходов.
+
+# Начало недели (понедельник) и месяца для даты в SQL
+PERIOD_STARTS = {
+    "week": "date({}, 'weekday 0', '-6 days')",
+    "month": "date({}, 'start of month')",
+}
+
+_UPSERT_DAY = f"""
+    INSERT INTO daily_totals (user_id, day, category, sum_cents, count)
+    SELECT user_id, date(date), category, ? * {AMOUNT_CENTS}, ?
+    FROM expenses WHERE id = ? AND user_id = ?
+    ON CONFLICT (user_id, day, category) DO UPDATE SET
+        sum_cents = sum_cents + excluded.sum_cents,
+        count = count + excluded.count
+"""
+
+_UPSERT_PERIODS = {
+    grain: f"""
+    INSERT INTO period_totals (user_id, grain, period, category, sum_cents, count)
+    SELECT user_id, '{grain}', {start.format("date")}, category, ? * {AMOUNT_CENTS}, ?
+    FROM expenses WHERE id = ? AND user_id = ?
+    ON CONFLICT (user_id, grain, period, category) DO UPDATE SET
+        sum_cents = sum_cents + excluded.sum_cents,
+        count = count + excluded.count
+    """
+    for grain, start in PERIOD_STARTS.items()
+}
+# Месячный итог категории - текущий счётчик для бюджетов: запрос возвращает
+# итог после изменения и сумму расхода, дополнительного SUM не нужно
+_UPSERT_MONTH = (
+    _UPSERT_PERIODS["month"]
+    + f"RETURNING category, period, sum_cents, (SELECT {AMOUNT_CENTS} FROM expenses WHERE id = ?)"
+)
+
+# Пустые корзины не храним: удаляются только корзины расхода, без просмотра остальных
+_DELETE_EMPTY_PERIODS = [
+    f"""
+    DELETE FROM period_totals
+    WHERE count <= 0 AND (user_id, grain, period, category) = (
+        SELECT user_id, '{grain}', {start.format("date")}, category FROM expenses WHERE id = ? AND user_id = ?
+    )
+    """
+    for grain, start in PERIOD_STARTS.items()
+]
+
+_ADD_NEW_DAYS = f"""
+    INSERT INTO daily_totals (user_id, day, category, sum_cents, count)
+    SELECT user_id, date(date), category, SUM({AMOUNT_CENTS}), COUNT(*)
+    FROM expenses
+    WHERE user_id = ? AND id > ?
+    GROUP BY date(date), category
+    ON CONFLICT (user_id, day, category) DO UPDATE SET
+        sum_cents = sum_cents + excluded.sum_cents,
+        count = count + excluded.count
+"""
+
+_ADD_NEW_PERIODS = [
+    f"""
+    INSERT INTO period_totals (user_id, grain, period, category, sum_cents, count)
+    SELECT user_id, '{grain}', {start.format("date")}, category, SUM({AMOUNT_CENTS}), COUNT(*)
+    FROM expenses
+    WHERE user_id = ? AND id > ?
+    GROUP BY {start.format("date")}, category
+    ON CONFLICT (user_id, grain, period, category) DO UPDATE SET
+        sum_cents = sum_cents + excluded.sum_cents,
+        count = count + excluded.count
+    """
+    for grain, start in PERIOD_STARTS.items()
+]
+
+# Недели и месяцы собираются из дневных итогов
+_FILL_PERIODS = [
+    f"""
+    INSERT INTO period_totals (user_id, grain, period, category, sum_cents, count)
+    SELECT user_id, '{grain}', {start.format("day")}, category, SUM(sum_cents), SUM(count)
+    FROM daily_totals
+    GROUP BY user_id, {start.format("day")}, category
+    """
+    for grain, start in PERIOD_STARTS.items()
+]
+
+
+async def apply_expense(conn, expense_id, user_id, sign):
+    """Прибавляет (sign=1) или вычитает (sign=-1) расход из дневных, недельных и месячных итогов.
+
+    Возвращает изменение месячного итога (категория, месяц, было, стало) в копейках
+    или None, если расхода нет.
+    """
+    await conn.execute(_UPSERT_DAY, (sign, sign, expense_id, user_id))
+    await conn.execute(_UPSERT_PERIODS["week"], (sign, sign, expense_id, user_id))
+    rows = await conn.execute_fetchall(_UPSERT_MONTH, (sign, sign, expense_id, user_id, expense_id))
+    if sign < 0:
+        # Пустые дни не храним
+        await conn.execute(
+            """
+            DELETE FROM daily_totals
+            WHERE count <= 0 AND (user_id, day, category) = (
+                SELECT user_id, date(date), category FROM expenses WHERE id = ? AND user_id = ?
+            )
+            """,
+            (expense_id, user_id)
+        )
+        for statement in _DELETE_EMPTY_PERIODS:
+            await conn.execute(statement, (expense_id, user_id))
+    if not rows:
+        return None
+    category, month, total_cents, amount_cents = rows[0]
+    return category, month, total_cents - sign * amount_cents, total_cents
+
+
+async def apply_new_expenses(conn, user_id, after_id):
+    """Прибавляет к итогам все расходы пользователя с id больше after_id."""
+    for statement in (_ADD_NEW_DAYS, *_ADD_NEW_PERIODS):
+        await conn.execute(statement, (user_id, after_id))
+
+
+async def backfill(conn):
+    """Полностью пересчитывает итоги по таблице расходов."""
+    await conn.execute("DELETE FROM daily_totals")
+    await conn.execute(
+        f"""
+        INSERT INTO daily_totals (user_id, day, category, sum_cents, count)
+        SELECT user_id, date(date), category, SUM({AMOUNT_CENTS}), COUNT(*)
+        FROM expenses
+        GROUP BY user_id, date(date), category
+        """
+    )
+    await conn.execute("DELETE FROM period_totals")
+    for statement in _FILL_PERIODS:
+        await conn.execute(statement)
+    rows = await conn.execute_fetchall("SELECT COUNT(*) FROM daily_totals")
+    return rows[0][0]
+
+
+async def main():
+    from config import DB_PATH, DB_SHARDS
+    from database import StorageProfile
+    from sharding import ShardRouter
+
+    router = ShardRouter(DB_PATH, shards=DB_SHARDS, readers=1, profile=StorageProfile.from_config())
+    await router.open()
+    try:
+        for db in router.databases:
+            async with db.writer() as conn:
+                await conn.execute("BEGIN")
+                count = await backfill(conn)
+            logging.info("Дневные итоги %s пересчитаны: %d строк", db.path, count)
+    finally:
+        await router.close()
+
+
+if __name__ == "__main__":
+    # Пересчёт для существующих баз: python rollups.py backfill
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["backfill"]:
+        print("Использование: python rollups.py backfill")
+        sys.exit(1)
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+import re
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from money import AMOUNT_CENTS, format_amount
+
+# Полнотекстовый поиск по описаниям расходов через индекс FTS5 expenses_fts
+# (миграция 10). Совпадения ранжируются по bm25; лучшие SEARCH_MAX_RESULTS id
+# вместе с итогами по всем совпадениям считаются один раз и кэшируются,
+# поэтому листание страниц - это выборка нескольких строк по первичному ключу.
+# Запрос передаётся в callback_data кнопок навигации:
+#   search:<номер страницы>:<запрос>
+
+SEARCH_PREFIX = "search:"
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_RESULTS = 100
+MAX_TERMS = 5
+# Ограничение Telegram на callback_data
+MAX_CALLBACK_BYTES = 64
+
+_WORD = re.compile(r"\w+")
+
+# Текст описания в индексе; то же выражение в триггерах миграции 10
+INDEXED_DESCRIPTION = "replace(replace(description, 'ё', 'е'), 'Ё', 'Е')"
+# Пакетная вставка: триггер на время транзакции отключается, новые строки
+# индексируются одним запросом. По строке триггер медленнее в несколько раз:
+# FTS5 сбрасывает накопленные изменения индекса в каждой точке сохранения
+PAUSE_INDEXING = "INSERT OR IGNORE INTO expenses_fts_paused (id) VALUES (1)"
+INDEX_NEW_EXPENSES = (
+    f"INSERT INTO expenses_fts (rowid, user_id, description) "
+    f"SELECT id, user_id, {INDEXED_DESCRIPTION} FROM expenses WHERE id > ?"
+)
+INDEX_USERS_EXPENSES = (
+    f"INSERT INTO expenses_fts (rowid, user_id, description) "
+    f"SELECT id, user_id, {INDEXED_DESCRIPTION} FROM expenses WHERE user_id IN ({{}})"
+)
+RESUME_INDEXING = "DELETE FROM expenses_fts_paused"
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+async def pause_indexing(conn):
+    """Отключает индексацию вставок до index_new_expenses в той же транзакции."""
+    await conn.execute(PAUSE_INDEXING)
+
+
+async def index_new_expenses(conn, after_id):
+    """Индексирует расходы с id больше after_id и включает индексацию вставок."""
+    await conn.execute(INDEX_NEW_EXPENSES, (after_id,))
+    await conn.execute(RESUME_INDEXING)
+
+
+async def index_users_expenses(conn, users):
+    """Индексирует все расходы пользователей users и включает индексацию вставок."""
+    await conn.execute(INDEX_USERS_EXPENSES.format(", ".join("?" * len(users))), users)
+    await conn.execute(RESUME_INDEXING)
+
+
+def normalize(text):
+    """Запрос в виде слов через пробел: нижний регистр, «ё» как «е», без знаков препинания."""
+    words = _WORD.findall((text or "").casefold().replace("ё", "е"))
+    if not words:
+        raise SearchQueryError("введите хотя бы одно слово")
+    if len(words) > MAX_TERMS:
+        raise SearchQueryError(f"не больше {MAX_TERMS} слов")
+    query = " ".join(words)
+    if len(_page_callback(query, SEARCH_MAX_RESULTS // SEARCH_PAGE_SIZE).encode()) > MAX_CALLBACK_BYTES:
+        raise SearchQueryError("слишком длинный запрос")
+    return query
+
+
+def match_expression(user_id, query):
+    # Каждое слово ищется по началу, чтобы «продукт» находил «продукты»
+    terms = " ".join(f'"{word}"*' for word in query.split())
+    return f'user_id : "{user_id}" AND description : ({terms})'
+
+
+async def run_search(conn, user_id, query):
+    """Ранжированные id лучших совпадений и итоги по всем: (ids, число, сумма в копейках)."""
+    expression = match_expression(user_id, query)
+    rows = await conn.execute_fetchall(
+        "SELECT rowid FROM expenses_fts WHERE expenses_fts MATCH ? ORDER BY rank LIMIT ?",
+        (expression, SEARCH_MAX_RESULTS)
+    )
+    ids = [row[0] for row in rows]
+    if len(ids) < SEARCH_MAX_RESULTS:
+        # Все совпадения уже на руках, итоги считаются только по ним
+        if not ids:
+            return ids, 0, 0
+        totals = await conn.execute_fetchall(
+            f"SELECT COUNT(*), SUM({AMOUNT_CENTS}) FROM expenses "
+            f"WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))})",
+            (user_id, *ids)
+        )
+    else:
+        totals = await conn.execute_fetchall(
+            f"SELECT COUNT(*), SUM({AMOUNT_CENTS}) FROM expenses_fts "
+            "JOIN expenses ON expenses.id = expenses_fts.rowid "
+            "WHERE expenses_fts MATCH ? AND expenses.user_id = ?",
+            (expression, user_id)
+        )
+    count, total_cents = totals[0]
+    return ids, count, total_cents or 0
+
+
+async def fetch_page(conn, user_id, ids, page):
+    """Строки страницы в порядке ранжирования."""
+    page_ids = ids[(page - 1) * SEARCH_PAGE_SIZE:page * SEARCH_PAGE_SIZE]
+    if not page_ids:
+        return []
+    rows = await conn.execute_fetchall(
+        f"SELECT id, {AMOUNT_CENTS}, category, description, date FROM expenses "
+        f"WHERE user_id = ? AND id IN ({', '.join('?' * len(page_ids))})",
+        (user_id, *page_ids)
+    )
+    by_id = {row[0]: row for row in rows}
+    return [by_id[expense_id] for expense_id in page_ids if expense_id in by_id]
+
+
+def _page_callback(query, page):
+    return f"{SEARCH_PREFIX}{page}:{query}"
+
+
+def parse_page_callback(data):
+    """Разбирает callback_data кнопки навигации в (номер страницы, запрос).
+
+    callback_data присылает клиент, поэтому запрос проверяется заново так же,
+    как введённый текст; при ошибке - ValueError (в том числе SearchQueryError).
+    """
+    page, query = data[len(SEARCH_PREFIX):].split(":", 1)
+    return int(page), normalize(query)
+
+
+def page_count(ids):
+    return max(1, (len(ids) + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE)
+
+
+def build_page(query, rows, page, ids, count, total_cents):
+    """Текст и клавиатура страницы результатов."""
+    if not count:
+        return f"🔍 По запросу «{query}» ничего не найдено.", None
+
+    response = (
+        f"🔍 Поиск: «{query}»\n"
+        f"📊 Найдено расходов: {count} на сумму {format_amount(total_cents)} руб.\n"
+    )
+    if count > len(ids):
+        response += f"Показаны {len(ids)} самых подходящих.\n"
+    pages = page_count(ids)
+    if pages > 1:
+        response += f"📄 Страница {page} из {pages}\n"
+    response += "\n"
+    for expense_id, amount, category, description, date in rows:
+        response += f"🆔 ID: {expense_id}\n"
+        response += f"💰 Сумма: {format_amount(amount)} руб.\n"
+        response += f"📁 Категория: {category}\n"
+        response += f"📝 Описание: {description}\n"
+        response += f"📅 Дата: {date}\n\n"
+
+    navigation = []
+    if page > 1:
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=_page_callback(query, page - 1)))
+    if page < pages:
+        navigation.append(InlineKeyboardButton(text="Далее ➡️", callback_data=_page_callback(query, page + 1)))
+    reply_markup = InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+    return response, reply_markup
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendDocument
+
+# Исходящие запросы к Telegram проходят через планировщик отправки:
+# токен-бакеты на каждый чат и общий на бота держат темп в пределах
+# лимитов Telegram, интерактивные ответы обгоняют загрузку файлов,
+# а TelegramRetryAfter и сетевые сбои повторяются с паузой, а не
+# доходят до обработчиков. Запросы без chat_id (getUpdates,
+# answerCallbackQuery) проходят без ограничений.
+
+# Приоритеты: меньше - раньше
+INTERACTIVE = 0
+BULK = 1
+
+BULK_METHODS = (SendDocument,)
+# Правки одного и того же сообщения, которые можно схлопнуть до последней
+COALESCED_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше burst про запас."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Через сколько секунд будет доступен токен (0 - уже доступен)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        # После flood control Telegram не принимает запросы до указанного срока
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.take()
+                return
+            await asyncio.sleep(wait)
+
+    def idle(self):
+        return self.delay() <= 0 and self.tokens >= self.burst
+
+
+class PriorityGate:
+    """Общий бакет бота: ожидающие получают токены в порядке приоритета."""
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self._waiters = []
+        self._counter = itertools.count()
+        self._pump_task = None
+
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority):
+        if not self._waiters and self.bucket.delay() <= 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            wait = self.bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            # Отменённые ожидания токен не расходуют
+            if not future.done():
+                self.bucket.take()
+                future.set_result(None)
+
+
+class _Chat:
+    def __init__(self, rate, burst):
+        # asyncio.Lock отпускает ожидающих по очереди: порядок сообщений в чате сохраняется
+        self.lock = asyncio.Lock()
+        self.bucket = TokenBucket(rate, burst)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов: подключается к сессии бота как request middleware."""
+
+    def __init__(
+        self,
+        global_rate=30,
+        chat_rate=1,
+        chat_burst=3,
+        group_rate=20 / 60,
+        max_retries=5,
+        max_chats=10000
+    ):
+        self.gate = PriorityGate(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = {}
+        self._edits = {}
+        self._edit_counter = itertools.count()
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.coalesced = 0
+        self._waits = deque(maxlen=1000)
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune()
+            # В группах Telegram разрешает около 20 сообщений в минуту
+            if isinstance(chat_id, int) and chat_id < 0:
+                chat = _Chat(self.group_rate, 1)
+            else:
+                chat = _Chat(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = chat
+        return chat
+
+    def _prune(self):
+        # Полные бакеты без очереди ничего не помнят, их можно забыть
+        for chat_id in [k for k, chat in self._chats.items() if not chat.lock.locked() and chat.bucket.idle()]:
+            del self._chats[chat_id]
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        edit_key = number = None
+        if isinstance(method, COALESCED_METHODS) and method.message_id is not None:
+            edit_key = (chat_id, method.message_id, type(method).__name__)
+            number = next(self._edit_counter)
+            self._edits.setdefault(edit_key, {"future": None})["latest"] = number
+
+        priority = BULK if isinstance(method, BULK_METHODS) else INTERACTIVE
+        chat = self._chat(chat_id)
+        enqueued = time.monotonic()
+        self.pending += 1
+        waiting = None
+        try:
+            async with chat.lock:
+                entry = self._edits.get(edit_key)
+                if entry is not None and entry["latest"] != number:
+                    # За этой правкой уже стоит более новая того же сообщения:
+                    # отправляется только она, а её результат достаётся всем
+                    self.coalesced += 1
+                    if entry["future"] is None:
+                        entry["future"] = asyncio.get_running_loop().create_future()
+                    superseded = entry["future"]
+                else:
+                    superseded = None
+                    if entry is not None:
+                        waiting, entry["future"] = entry["future"], None
+                    await chat.bucket.acquire()
+                    await self.gate.acquire(priority)
+                    self._waits.append(time.monotonic() - enqueued)
+                    try:
+                        result = await self._send(make_request, bot, method, chat)
+                    except Exception as e:
+                        if waiting is not None and not waiting.done():
+                            waiting.set_exception(e)
+                        raise
+                    if waiting is not None and not waiting.done():
+                        waiting.set_result(result)
+                    return result
+        finally:
+            self.pending -= 1
+            entry = self._edits.get(edit_key)
+            if entry is not None and entry["latest"] == number:
+                del self._edits[edit_key]
+                # Последняя правка так и не ушла (отмена): ждущим её больше нечего ждать
+                if entry["future"] is not None:
+                    entry["future"].cancel()
+            if waiting is not None and not waiting.done():
+                waiting.cancel()
+        return await superseded
+
+    async def _send(self, make_request, bot, method, chat):
+        attempt = 0
+        while True:
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                # Ждём столько, сколько просит Telegram, плюс случайная добавка,
+                # чтобы отложенные запросы не вернулись одновременно
+                delay = e.retry_after + random.uniform(0, 1)
+                self.flood_waits += 1
+                chat.bucket.pause(delay)
+                logging.warning("Flood control в чате %s, повтор через %.1f с", method.chat_id, delay)
+            except (TelegramNetworkError, TelegramServerError):
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                # Экспоненциальная пауза с джиттером
+                delay = min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                await asyncio.sleep(delay)
+            except Exception:
+                self.failed += 1
+                raise
+            attempt += 1
+            self.retries += 1
+            await chat.bucket.acquire()
+            await self.gate.acquire(INTERACTIVE)
+
+    def stats(self):
+        waits = sorted(self._waits)
+        return {
+            "pending": self.pending,
+            "waiting_global": self.gate.waiting(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "coalesced": self.coalesced,
+            "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0,
+            "wait_p99_ms": round(waits[int(len(waits) * 0.99)] * 1000, 1) if waits else 0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0,
+        }
@@ -0,0 +1,441 @@
+import asyncio
+import logging
+import os
+import sys
+from contextlib import asynccontextmanager
+
+from database import Database, Maintenance, StorageProfile, WriteQueue
+from migrations import migrate
+from money import AMOUNT_CENTS, format_amount
+import search
+
+# Шардирование: пользователи распределены по K файлам SQLite, у каждого
+# свой writer и своя очередь записи. Пользователь попадает в один из
+# BUCKETS виртуальных бакетов (user_id % BUCKETS), а карта «бакет -> шард»
+# хранится в главном шарде (исходный DB_PATH). При смене числа шардов
+# бакеты переносятся по одному, не останавливая бота: запросы к
+# переносимому бакету ждут окончания переноса, остальные идут как обычно.
+# Состояния FSM и карта бакетов всегда живут в главном шарде.
+
+BUCKETS = 1024
+
+# Таблицы с данными пользователя, которые переезжают вместе с бакетом
+USER_TABLES = ("expenses", "daily_totals", "period_totals", "budgets", "user_data_versions")
+
+# Шард с номером i выдаёт id расходов начиная с i * SHARD_ID_RANGE. При переносе
+# записи сохраняют свои id, поэтому старые кнопки «Удалить» и «Изменить» и курсоры
+# истории продолжают указывать на ту же запись и не попадают в чужую
+SHARD_ID_RANGE = 10 ** 12
+
+# Номер бакета в SQL так же, как в Python, и для отрицательных id
+SQL_BUCKET = f"((user_id % {BUCKETS}) + {BUCKETS}) % {BUCKETS}"
+
+
+def bucket_for(user_id):
+    return user_id % BUCKETS
+
+
+def shard_path(path, index):
+    # Шард 0 - исходная база, остальные лежат рядом: expenses_1.db, expenses_2.db...
+    if index == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{index}{ext}"
+
+
+async def _noop(conn):
+    return None
+
+
+class ShardRouter:
+    """Направляет чтение и запись пользователя в его шард."""
+
+    def __init__(self, path, shards=1, readers=4, max_batch=100, max_delay=0.01, on_moved=None, profile=None):
+        self.path = path
+        self.shards = max(1, shards)
+        self.readers = readers
+        self.profile = profile or StorageProfile()
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # Вызывается со списком перенесённых пользователей, чтобы сбросить их кэши
+        self.on_moved = on_moved
+        self.databases = []
+        self.write_queues = []
+        self.maintenance = []
+        self._add_shard()
+        self._buckets = [0] * BUCKETS
+        self._moving = {}
+        self._started = False
+        self._interrupted = False
+        self.moved_buckets = 0
+        self.moved_users = 0
+
+    @property
+    def main_db(self):
+        return self.databases[0]
+
+    @property
+    def main_queue(self):
+        return self.write_queues[0]
+
+    def _add_shard(self):
+        db = Database(shard_path(self.path, len(self.databases)), readers=self.readers, profile=self.profile)
+        self.databases.append(db)
+        self.write_queues.append(WriteQueue(db, max_batch=self.max_batch, max_delay=self.max_delay))
+        self.maintenance.append(Maintenance(db))
+        return db
+
+    async def open(self):
+        """Открывает все шарды, обновляет их схему и загружает карту бакетов."""
+        await self.main_db.open()
+        await migrate(self.main_db)
+        await self._load_map()
+        # Шардов открывается столько, сколько нужно и по настройке, и по карте:
+        # при уменьшении числа шардов лишние остаются открытыми до переноса
+        needed = max(self.shards, max(self._buckets) + 1)
+        while len(self.databases) < needed:
+            self._add_shard()
+        for index, db in enumerate(self.databases[1:], start=1):
+            await db.open()
+            await migrate(db)
+            await _reserve_ids(db, index)
+
+    async def _load_map(self):
+        async with self.main_db.reader() as conn:
+            rows = await conn.execute_fetchall("SELECT bucket, shard FROM shard_buckets")
+        if rows:
+            for bucket, shard in rows:
+                self._buckets[bucket] = shard
+            return
+        # Карты ещё нет: все данные лежат в единственной исходной базе
+        async with self.main_db.writer() as conn:
+            await conn.executemany(
+                "INSERT INTO shard_buckets (bucket, shard) VALUES (?, 0)",
+                [(bucket,) for bucket in range(BUCKETS)]
+            )
+
+    def start(self):
+        for queue in self.write_queues:
+            queue.start()
+        for maintenance in self.maintenance:
+            maintenance.start()
+        self._started = True
+
+    async def stop(self):
+        for maintenance in self.maintenance:
+            await maintenance.stop()
+        for queue in self.write_queues:
+            await queue.stop()
+        self._started = False
+
+    def maintenance_stats(self):
+        return {maintenance.label: maintenance.stats() for maintenance in self.maintenance}
+
+    async def close(self):
+        for db in self.databases:
+            await db.close()
+
+    def shard_index(self, user_id):
+        return self._buckets[bucket_for(user_id)]
+
+    def path_for(self, user_id):
+        return self.databases[self.shard_index(user_id)].path
+
+    async def _wait_moving(self, user_id):
+        event = self._moving.get(bucket_for(user_id))
+        if event is not None:
+            await event.wait()
+
+    @asynccontextmanager
+    async def reader(self, user_id):
+        await self._wait_moving(user_id)
+        async with self.databases[self.shard_index(user_id)].reader() as conn:
+            yield conn
+
+    async def submit(self, user_id, operation):
+        # Между проверкой и постановкой в очередь нет точек переключения,
+        # поэтому перенос бакета не может начаться посередине
+        await self._wait_moving(user_id)
+        return await self.write_queues[self.shard_index(user_id)].submit(operation)
+
+    async def _write(self, index, operation):
+        # Вне работающего бота (CLI) пишем напрямую, без очереди
+        if self._started:
+            return await self.write_queues[index].submit(operation)
+        async with self.databases[index].writer() as conn:
+            await conn.execute("BEGIN")
+            return await operation(conn)
+
+    # --- Перебалансировка ---
+
+    def plan(self):
+        """Возвращает список переносов (бакет, из шарда, в шард) с минимумом перемещений."""
+        quota, extra = divmod(BUCKETS, self.shards)
+        limits = [quota + (1 if index < extra else 0) for index in range(self.shards)]
+        kept = [0] * self.shards
+        homeless = []
+        for bucket, shard in enumerate(self._buckets):
+            if shard < self.shards and kept[shard] < limits[shard]:
+                kept[shard] += 1
+            else:
+                homeless.append(bucket)
+        moves = []
+        target = 0
+        for bucket in homeless:
+            while kept[target] >= limits[target]:
+                target += 1
+            kept[target] += 1
+            moves.append((bucket, self._buckets[bucket], target))
+        return moves
+
+    def needs_rebalance(self):
+        return bool(self.plan())
+
+    async def _bucket_users(self, index, bucket):
+        async with self.databases[index].reader() as conn:
+            rows = await conn.execute_fetchall(
+                " UNION ".join(
+                    f"SELECT DISTINCT user_id FROM {table} WHERE {SQL_BUCKET} = :bucket" for table in USER_TABLES
+                ),
+                {"bucket": bucket}
+            )
+        return [user_id for (user_id,) in rows]
+
+    async def move_bucket(self, bucket, target):
+        """Переносит все данные бакета в другой шард и переключает карту."""
+        source = self._buckets[bucket]
+        if source == target:
+            return 0
+        event = asyncio.Event()
+        self._moving[bucket] = event
+        try:
+            # Операции, поставленные в очередь до начала переноса, должны зафиксироваться
+            if self._started:
+                await self.write_queues[source].submit(_noop)
+            # Пользователи бакета читаются только теперь: запись в бакет уже ждёт
+            # окончания переноса, и данные нового пользователя не останутся в старом шарде
+            users = await self._bucket_users(source, bucket)
+            if users:
+                await self._copy_users(source, target, users)
+
+            async def switch(conn):
+                await conn.execute("UPDATE shard_buckets SET shard = ? WHERE bucket = ?", (target, bucket))
+
+            await self._write(0, switch)
+            self._buckets[bucket] = target
+
+            if users:
+                await self._write(source, lambda conn: _delete_users(conn, users))
+        finally:
+            del self._moving[bucket]
+            event.set()
+
+        self.moved_buckets += 1
+        self.moved_users += len(users)
+        if users and self.on_moved is not None:
+            self.on_moved(users)
+        return len(users)
+
+    async def _copy_users(self, source, target, users):
+        marks = ", ".join("?" * len(users))
+        async with self.databases[source].reader() as conn:
+            expenses = await conn.execute_fetchall(
+                f"SELECT id, user_id, {AMOUNT_CENTS}, category, description, date FROM expenses "
+                f"WHERE user_id IN ({marks}) ORDER BY id",
+                users
+            )
+            totals = await conn.execute_fetchall(
+                f"SELECT user_id, day, category, sum_cents, count FROM daily_totals WHERE user_id IN ({marks})",
+                users
+            )
+            periods = await conn.execute_fetchall(
+                f"SELECT user_id, grain, period, category, sum_cents, count FROM period_totals "
+                f"WHERE user_id IN ({marks})",
+                users
+            )
+            budgets = await conn.execute_fetchall(
+                f"SELECT user_id, category, limit_cents FROM budgets WHERE user_id IN ({marks})",
+                users
+            )
+            versions = dict(await conn.execute_fetchall(
+                f"SELECT user_id, version FROM user_data_versions WHERE user_id IN ({marks})",
+                users
+            ))
+
+        async def copy(conn):
+            # Остатки прерванного переноса в целевом шарде удаляются
+            await _delete_users(conn, users)
+            await search.pause_indexing(conn)
+            await conn.executemany(
+                "INSERT INTO expenses (id, user_id, amount_cents, category, description, date) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                expenses
+            )
+            # id бывает занят записью другого пользователя, если она попала в шард до
+            # выделения диапазонов id: такие записи получают новый id. Все запросы ищут
+            # запись по (id, user_id), поэтому старая кнопка чужую запись не найдёт
+            copied = {row[0] for row in await conn.execute_fetchall(
+                f"SELECT id FROM expenses WHERE user_id IN ({marks})",
+                users
+            )}
+            await conn.executemany(
+                "INSERT INTO expenses (user_id, amount_cents, category, description, date) VALUES (?, ?, ?, ?, ?)",
+                [expense[1:] for expense in expenses if expense[0] not in copied]
+            )
+            # Поисковый индекс для скопированных расходов - одним запросом;
+            # из исходного шарда записи уходят из индекса триггером удаления
+            await search.index_users_expenses(conn, users)
+            await conn.executemany(
+                "INSERT INTO daily_totals (user_id, day, category, sum_cents, count) VALUES (?, ?, ?, ?, ?)",
+                totals
+            )
+            await conn.executemany(
+                "INSERT INTO period_totals (user_id, grain, period, category, sum_cents, count) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                periods
+            )
+            await conn.executemany(
+                "INSERT INTO budgets (user_id, category, limit_cents) VALUES (?, ?, ?)",
+                budgets
+            )
+            # Новая версия данных, как при любой записи: кэши пользователя начинаются заново
+            await conn.executemany(
+                "INSERT INTO user_data_versions (user_id, version) VALUES (?, ?)",
+                [(user_id, versions.get(user_id, 0) + 1) for user_id in users]
+            )
+
+        await self._write(target, copy)
+
+    async def rebalance(self):
+        """Приводит карту бакетов к текущему числу шардов. Возвращает число перенесённых бакетов."""
+        moves = self.plan()
+        if not moves:
+            return 0
+        logging.info("Перебалансировка шардов: переносится %d бакетов", len(moves))
+        self._interrupted = False
+        for bucket, source, target in moves:
+            if self._interrupted:
+                # Остальные бакеты перенесутся при следующем запуске
+                logging.info("Перебалансировка прервана, перенесено %d бакетов", self.moved_buckets)
+                return self.moved_buckets
+            await self.move_bucket(bucket, target)
+        await self.cleanup()
+        logging.info(
+            "Перебалансировка завершена: %d бакетов, %d пользователей",
+            len(moves), self.moved_users
+        )
+        return len(moves)
+
+    def interrupt(self):
+        # Остановка перебалансировки после текущего бакета
+        self._interrupted = True
+
+    async def cleanup(self):
+        """Удаляет из шардов данные бакетов, которые им больше не принадлежат."""
+        removed = 0
+        for index in range(len(self.databases)):
+            foreign = [bucket for bucket, shard in enumerate(self._buckets) if shard != index]
+            if not foreign:
+                continue
+            marks = ", ".join("?" * len(foreign))
+
+            async def purge(conn):
+                count = 0
+                for table in USER_TABLES:
+                    cursor = await conn.execute(
+                        f"DELETE FROM {table} WHERE {SQL_BUCKET} IN ({marks})",
+                        foreign
+                    )
+                    count += cursor.rowcount
+                return count
+
+            removed += await self._write(index, purge)
+        if removed:
+            logging.warning("Удалено осиротевших строк в шардах: %d", removed)
+        return removed
+
+    # --- Запросы по всем шардам ---
+
+    async def query_all(self, sql, params=()):
+        """Выполняет запрос на чтение во всех шардах параллельно и возвращает строки по шардам."""
+        async def run(db):
+            async with db.reader() as conn:
+                return await conn.execute_fetchall(sql, params)
+
+        return await asyncio.gather(*(run(db) for db in self.databases))
+
+    async def stats(self):
+        counts = await self.query_all(
+            f"SELECT COUNT(DISTINCT user_id), COUNT(*), COALESCE(SUM({AMOUNT_CENTS}), 0) FROM expenses"
+        )
+        result = []
+        for index, rows in enumerate(counts):
+            users, expenses, total = rows[0]
+            result.append({
+                "shard": index,
+                "path": self.databases[index].path,
+                "buckets": self._buckets.count(index),
+                "users": users,
+                "expenses": expenses,
+                "total_cents": total,
+            })
+        return result
+
+
+async def _reserve_ids(db, index):
+    # Счётчик AUTOINCREMENT только растёт, поэтому сдвигается не дальше начала диапазона шарда
+    start = index * SHARD_ID_RANGE
+    async with db.writer() as conn:
+        await conn.execute("BEGIN")
+        await conn.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'expenses' AND seq < ?",
+            (start, start)
+        )
+        await conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'expenses', ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'expenses')",
+            (start,)
+        )
+
+
+async def _delete_users(conn, users):
+    marks = ", ".join("?" * len(users))
+    for table in USER_TABLES:
+        await conn.execute(f"DELETE FROM {table} WHERE user_id IN ({marks})", users)
+
+
+async def main(command, args):
+    from config import DB_PATH, DB_SHARDS
+
+    router = ShardRouter(DB_PATH, shards=DB_SHARDS, readers=2, profile=StorageProfile.from_config())
+    await router.open()
+    try:
+        if command == "rebalance":
+            moved = await router.rebalance()
+            print(f"Перенесено бакетов: {moved}")
+        elif command == "stats":
+            for shard in await router.stats():
+                print(
+                    f"#{shard['shard']} {shard['path']}: бакетов {shard['buckets']}, "
+                    f"пользователей {shard['users']}, расходов {shard['expenses']}, "
+                    f"сумма {format_amount(shard['total_cents'])}"
+                )
+        elif command == "query":
+            for index, rows in enumerate(await router.query_all(args[0])):
+                for row in rows:
+                    print(index, *row, sep="\t")
+    finally:
+        await router.close()
+
+
+if __name__ == "__main__":
+    # Обслуживание шардов:
+    #   python sharding.py stats                - распределение данных по шардам
+    #   python sharding.py rebalance            - перенос бакетов под DB_SHARDS (бот лучше остановить)
+    #   python sharding.py query "SELECT ..."   - запрос на чтение по всем шардам
+    logging.basicConfig(level=logging.INFO)
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else (None, [])
+    if command not in ("stats", "rebalance", "query") or (command == "query") != bool(args):
+        print('Использование: python sharding.py stats | rebalance | query "SELECT ..."')
+        sys.exit(1)
+    asyncio.run(main(command, args))
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite со сквозной записью и LRU-кэшем в памяти.
+
+    Чтение состояния обслуживается из памяти, запись сразу уходит в таблицу
+    fsm_states через общую очередь записи, поэтому незавершённые сценарии
+    переживают перезапуск бота. Брошенные диалоги истекают по TTL.
+    """
+
+    def __init__(self, db, write_queue, max_entries=10000, ttl=24 * 60 * 60, purge_interval=60 * 60):
+        self.db = db
+        self.write_queue = write_queue
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._cache = OrderedDict()
+        self._purge_task = None
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def start(self):
+        if self._purge_task is None:
+            self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def close(self):
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+
+    async def _load(self, key):
+        record = self._cache.get(key)
+        if record is None:
+            async with self.db.reader() as conn:
+                rows = await conn.execute_fetchall(
+                    "SELECT state, data, updated_at FROM fsm_states WHERE key = ?",
+                    (key,)
+                )
+            if rows:
+                state, data, updated_at = rows[0]
+                record = [state, json.loads(data) if data else {}, updated_at]
+            else:
+                record = [None, {}, time.time()]
+            self._remember(key, record)
+        else:
+            self._cache.move_to_end(key)
+
+        if record[0] is not None or record[1]:
+            if record[2] < time.time() - self.ttl:
+                # Диалог заброшен: начинаем с чистого листа
+                record[0], record[1] = None, {}
+        return record
+
+    def _remember(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _save(self, key, record):
+        record[2] = time.time()
+        self._remember(key, record)
+        state, data, updated_at = record[0], dict(record[1]), record[2]
+
+        async def persist(conn):
+            if state is None and not data:
+                # Пустые записи не храним
+                await conn.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+            else:
+                await conn.execute(
+                    """
+                    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                    """,
+                    (key, state, json.dumps(data, ensure_ascii=False) if data else None, updated_at)
+                )
+
+        await self.write_queue.submit(persist)
+
+    async def set_state(self, key, state=None):
+        storage_key = self._key(key)
+        record = await self._load(storage_key)
+        record[0] = state.state if isinstance(state, State) else state
+        await self._save(storage_key, record)
+
+    async def get_state(self, key):
+        record = await self._load(self._key(key))
+        return record[0]
+
+    async def set_data(self, key, data):
+        storage_key = self._key(key)
+        record = await self._load(storage_key)
+        record[1] = dict(data)
+        await self._save(storage_key, record)
+
+    async def get_data(self, key):
+        record = await self._load(self._key(key))
+        return dict(record[1])
+
+    async def purge_expired(self):
+        expire_before = time.time() - self.ttl
+
+        async def purge(conn):
+            cursor = await conn.execute(
+                "DELETE FROM fsm_states WHERE updated_at < ?",
+                (expire_before,)
+            )
+            return cursor.rowcount
+
+        removed = await self.write_queue.submit(purge)
+        for key in [k for k, record in self._cache.items() if record[2] < expire_before]:
+            del self._cache[key]
+        if removed:
+            logging.info("Удалено заброшенных FSM-состояний: %d", removed)
+        return removed
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception:
+                logging.exception("Не удалось очистить устаревшие FSM-состояния")
+            await asyncio.sleep(self.purge_interval)
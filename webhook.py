@@ -0,0 +1,91 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import types
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приём обновлений через вебхук: быстрый ответ 200 и обработка в фоне.
+
+    Число одновременно обрабатываемых обновлений ограничено: когда все слоты
+    заняты, ответ Telegram задерживается, и он сам снижает темп отправки.
+    """
+
+    def __init__(self, dp, bot, path="/webhook", secret=None, max_concurrent=100, forward=None):
+        self.dp = dp
+        # В многопроцессном режиме обновления не обрабатываются здесь, а передаются дальше
+        self.forward = forward
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks = set()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_health(self, request):
+        return web.json_response({"status": "ok", "in_flight": len(self._tasks)})
+
+    async def handle_update(self, request):
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        # Некорректное тело - ответ 400 и в режиме пересылки: на 5xx Telegram повторяет отправку
+        try:
+            data = await request.json()
+            update = types.Update.model_validate(data, context={"bot": self.bot})
+        except Exception:
+            logging.warning("Получено некорректное обновление на вебхук")
+            return web.Response(status=400)
+        if self.forward is not None:
+            self.forward(data)
+            return web.Response()
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("Ошибка обработки обновления %s", update.update_id)
+        finally:
+            self._semaphore.release()
+
+    async def wait_closed(self):
+        # Дожидаемся обработки уже принятых обновлений
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_webhook(dp, bot, host, port, path, secret=None, url=None, max_concurrent=100, forward=None):
+    server = WebhookServer(dp, bot, path=path, secret=secret, max_concurrent=max_concurrent, forward=forward)
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Вебхук слушает http://%s:%d%s", host, port, path)
+
+    # Без публичного адреса сервер можно проверять локально, отправляя ему обновления вручную
+    if url:
+        await bot.set_webhook(
+            url=url.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await server.wait_closed()
+        await bot.session.close()
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+
+# Многопроцессный режим: супервизор получает обновления и раскладывает их
+# по N рабочим процессам по user_id. Все обновления одного пользователя
+# всегда попадают в один процесс и обрабатываются там по порядку, поэтому
+# состояние FSM и кэши пользователя остаются согласованными.
+
+
+def update_user_id(update):
+    """Достаёт id пользователя из «сырого» обновления Telegram."""
+    for field, event in update.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user and "id" in user:
+            return user["id"]
+        chat = event.get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+def shard_for(user_id, workers):
+    return hash(user_id) % workers
+
+
+class Supervisor:
+    """Запускает рабочие процессы, следит за их здоровьем и перезапускает упавшие."""
+
+    def __init__(self, target, workers, health_interval=5, health_timeout=30):
+        self.target = target
+        self.workers = workers
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._heartbeats = [None] * workers
+        self.restarts = 0
+        self.routed = [0] * workers
+
+    def _spawn(self, index):
+        heartbeat = self._context.Value("d", time.time())
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self._queues[index], heartbeat),
+            name=f"bot-worker-{index}",
+            # Не демон: пул процессов отчётов запускает из рабочего процесса свои процессы,
+            # а у демонов дочерних процессов быть не может. Завершает процессы stop()
+            daemon=False
+        )
+        process.start()
+        self._processes[index] = process
+        self._heartbeats[index] = heartbeat
+        logging.info("Запущен рабочий процесс %d (pid %s)", index, process.pid)
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def route(self, update):
+        # Обновление передаётся как dict: рабочий процесс сам собирает из него Update
+        index = shard_for(update_user_id(update), self.workers)
+        self._queues[index].put(update)
+        self.routed[index] += 1
+
+    def check_health(self):
+        now = time.time()
+        for index, process in enumerate(self._processes):
+            stale = now - self._heartbeats[index].value > self.health_timeout
+            if process.is_alive() and not stale:
+                continue
+            logging.error(
+                "Рабочий процесс %d %s, перезапускаем",
+                index, "завис" if process.is_alive() else f"завершился с кодом {process.exitcode}"
+            )
+            if process.is_alive():
+                process.terminate()
+                process.join(5)
+            # Процесс мог погибнуть, удерживая блокировку чтения очереди,
+            # поэтому новый процесс получает новую очередь. Обновления,
+            # оставшиеся в старой, теряются - Telegram не присылает их повторно.
+            self._queues[index].close()
+            self._queues[index] = self._context.Queue()
+            self._spawn(index)
+            self.restarts += 1
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            self.check_health()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "restarts": self.restarts,
+            "routed": list(self.routed),
+        }
+
+    def stop(self, timeout=30):
+        for queue in self._queues:
+            queue.put(None)
+        deadline = time.time() + timeout
+        for process in self._processes:
+            if process is not None:
+                process.join(max(0, deadline - time.time()))
+                if process.is_alive():
+                    process.terminate()
+
+
+async def poll_updates(bot, supervisor, allowed_updates, timeout=30):
+    """Long polling в супервизоре: обновления не обрабатываются, а раскладываются по процессам."""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except Exception:
+            logging.exception("Ошибка получения обновлений")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            supervisor.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def consume_updates(dp, bot, queue, heartbeat):
+    """Цикл рабочего процесса: обновления одного пользователя обрабатываются строго по очереди."""
+    loop = asyncio.get_running_loop()
+    tails = {}
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(1)
+
+    def forget(user_id, task):
+        # Хвост очереди пользователя больше не нужен, если за ним ничего не пришло
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    async def process(update, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+
+    beat_task = asyncio.create_task(beat())
+    try:
+        while True:
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+            user_id = update_user_id(update)
+            task = asyncio.create_task(process(update, tails.get(user_id)))
+            tails[user_id] = task
+            task.add_done_callback(lambda done, user_id=user_id: forget(user_id, done))
+        if tails:
+            await asyncio.gather(*tails.values(), return_exceptions=True)
+    finally:
+        beat_task.cancel()